@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import shutil
+import tempfile
+import time
+from bisect import bisect
+from optparse import make_option
+os.environ['DJANGO_SETTINGS_MODULE'] = 'pootle.settings'
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import simplejson
+
+from translate.storage import po
+
+from pootle_language.models import Language
+from pootle_misc.forms import make_search_form
+from pootle_project.models import Project
+from pootle_store.models import fs
+from pootle_store.views import (get_non_indexed_search_step_query,
+                                get_search_results,
+                                search_translation_projects)
+from pootle_translationproject.models import TranslationProject
+
+
+PROJECT_CODE = "search-benchmark"
+LANGUAGE_CODE = "x_bench%d"
+
+
+def make_vocabulary(rng, size):
+    """Returns ``size`` distinct pronounceable words."""
+    syllables = [consonant + vowel for consonant in "bdfgklmnprstvz"
+                                   for vowel in "aeiou"]
+    words = set()
+    vocabulary = []
+    while len(vocabulary) < size:
+        word = "".join([rng.choice(syllables)
+                        for i in range(rng.randint(2, 4))])
+        if word not in words:
+            words.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--languages', dest='languages', type='int', default=3,
+                    help='number of languages in the corpus'),
+        make_option('--stores', dest='stores', type='int', default=10,
+                    help='number of files per language'),
+        make_option('--units', dest='units', type='int', default=100,
+                    help='number of units per file'),
+        make_option('--words', dest='words', type='int', default=8,
+                    help='average number of words per unit'),
+        make_option('--vocabulary', dest='vocabulary', type='int',
+                    default=2000, help='number of distinct words'),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+                    help='number of runs of every search'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='seed of the corpus generator'),
+        )
+    help = "Measure search speed on a synthetic corpus, one JSON " \
+           "object per line."
+
+    def handle_noargs(self, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+
+        if Project.objects.filter(code=PROJECT_CODE).exists():
+            raise CommandError("Project %s already exists, remove it first." %
+                               PROJECT_CODE)
+        if Language.objects.filter(code__startswith=LANGUAGE_CODE[:-2]) \
+                           .exists():
+            raise CommandError("Benchmark languages already exist, remove "
+                               "them first.")
+
+        old_podirectory = settings.PODIRECTORY
+        old_background_build = getattr(settings, 'INDEX_BACKGROUND_BUILD',
+                                       True)
+        old_update_delay = getattr(settings, 'INDEX_UPDATE_DELAY', 2)
+        podirectory = tempfile.mkdtemp()
+        settings.PODIRECTORY = podirectory
+        fs.location = podirectory
+        # Indexes are built from scratch and measured below
+        settings.INDEX_BACKGROUND_BUILD = False
+        settings.INDEX_UPDATE_DELAY = 3600
+
+        project = None
+        languages = []
+        try:
+            self.write_corpus(podirectory)
+            for i in range(options['languages']):
+                languages.append(Language.objects.create(
+                        code=LANGUAGE_CODE % i,
+                        fullname=u"Benchmark %d" % i))
+            # Creates the translation projects of the new languages
+            project = Project.objects.create(
+                    code=PROJECT_CODE, fullname=u"Search benchmark",
+                    source_language=Language.objects.get(code='en'),
+                    treestyle='nongnu')
+            translation_projects = list(project.translationproject_set \
+                                               .order_by('pootle_path'))
+            self.emit(self.build_corpus(translation_projects))
+            for result in self.run_searches(translation_projects):
+                self.emit(result)
+        finally:
+            if project is not None:
+                project.delete()
+            for language in languages:
+                language.delete()
+            TranslationProject._non_db_state_cache.clear()
+            settings.PODIRECTORY = old_podirectory
+            fs.location = old_podirectory
+            settings.INDEX_BACKGROUND_BUILD = old_background_build
+            settings.INDEX_UPDATE_DELAY = old_update_delay
+            shutil.rmtree(podirectory)
+
+    def emit(self, result):
+        print simplejson.dumps(result, sort_keys=True)
+
+    def write_corpus(self, podirectory):
+        """Writes the PO files of every language, with the same sources and
+        different, partly missing, translations.
+
+        Words are drawn with a Zipf distribution, so that there are both
+        very common and rare words.
+        """
+        options = self.options
+        rng = self.rng
+        size = options['vocabulary']
+        self.source_vocabulary = make_vocabulary(rng, size)
+        target_vocabularies = [make_vocabulary(rng, size)
+                               for i in range(options['languages'])]
+
+        weights = []
+        total = 0.0
+        for rank in range(size):
+            total += 1.0 / (rank + 1)
+            weights.append(total)
+
+        self.word_counts = [0] * size
+        sources = []
+        for i in range(options['stores'] * options['units']):
+            length = max(1, int(rng.gauss(options['words'],
+                                          options['words'] / 2.0)))
+            words = [bisect(weights, rng.random() * total)
+                     for j in range(length)]
+            for word in words:
+                self.word_counts[word] += 1
+            sources.append(words)
+
+        for i, target_vocabulary in enumerate(target_vocabularies):
+            language_dir = os.path.join(podirectory, PROJECT_CODE,
+                                        LANGUAGE_CODE % i)
+            os.makedirs(language_dir)
+            for store_number in range(options['stores']):
+                store = po.pofile()
+                for unit_number in range(options['units']):
+                    words = sources[store_number * options['units'] +
+                                    unit_number]
+                    unit = store.addsourceunit(
+                            u" ".join([self.source_vocabulary[word]
+                                       for word in words]))
+                    if rng.random() < 0.8:
+                        unit.target = u" ".join([target_vocabulary[word]
+                                                 for word in words])
+                    unit.addlocation("file_%d.c:%d" % (store_number,
+                                                        unit_number))
+                store.savefile(os.path.join(language_dir,
+                                            "file_%d.po" % store_number))
+
+    def build_corpus(self, translation_projects):
+        """Parses the stores and builds the search indexes."""
+        result = {
+            'type': 'corpus',
+            'languages': len(translation_projects),
+            'stores': self.options['stores'],
+            'units': self.options['units'],
+            'words': self.options['words'],
+            'vocabulary': self.options['vocabulary'],
+            'seed': self.options['seed'],
+            'parse_seconds': 0.0,
+            'index_seconds': 0.0,
+            'backend': None,
+        }
+        for translation_project in translation_projects:
+            start = time.time()
+            translation_project.require_units()
+            result['parse_seconds'] += time.time() - start
+
+            start = time.time()
+            indexer = translation_project.build_index()
+            result['index_seconds'] += time.time() - start
+            if indexer is not None:
+                result['backend'] = indexer.INDEX_DIRECTORY_NAME
+        return result
+
+    def get_searches(self):
+        """Returns the query shapes to measure, as ``(name, search,
+        fields)`` tuples."""
+        vocabulary = self.source_vocabulary
+        used = [word for word in range(len(vocabulary))
+                if self.word_counts[word]]
+        rare = min(used, key=lambda word: self.word_counts[word])
+        return [
+            ('common_word', vocabulary[0], ['source']),
+            ('rare_word', vocabulary[rare], ['source']),
+            ('two_words', u"%s %s" % (vocabulary[0], vocabulary[1]),
+             ['source']),
+            ('substring', vocabulary[1][1:4], ['source']),
+            ('source_and_target', vocabulary[2], ['source', 'target']),
+            ('location', u"file_0.c", ['locations']),
+            ('no_match', u"qxqxqx", ['source', 'target']),
+        ]
+
+    def measure(self, func):
+        """Calls ``func`` ``--repeat`` times.
+
+        :return: The last result of ``func`` and a dictionary of timings.
+        """
+        timings = []
+        for i in range(max(self.options['repeat'], 1)):
+            start = time.time()
+            result = func()
+            timings.append(time.time() - start)
+        timings.sort()
+        return result, {
+            'runs': len(timings),
+            'min': timings[0],
+            'median': timings[len(timings) / 2],
+            'mean': sum(timings) / len(timings),
+            'max': timings[-1],
+            'qps': len(timings) / max(sum(timings), 1e-9),
+        }
+
+    def run_searches(self, translation_projects):
+        translation_project = translation_projects[0]
+        store = translation_project.stores.order_by('pootle_path')[0]
+        scopes = [('store', store.pootle_path, store.units),
+                  ('translation_project', translation_project.pootle_path,
+                   translation_project.units)]
+        backend = 'database'
+        if translation_project.indexer is not None:
+            backend = translation_project.indexer.INDEX_DIRECTORY_NAME
+
+        for name, search, fields in self.get_searches():
+            form = make_search_form({'search': search, 'sfields': fields})
+            if not form.is_valid():
+                continue
+
+            base = {'type': 'search', 'query': name, 'search': search,
+                    'fields': fields}
+            for scope, pootle_path, units in scopes:
+                def indexed_cold():
+                    # Changing the generation misses the cached results
+                    translation_project._update_index_generation()
+                    return get_search_results(translation_project, form,
+                                              pootle_path)
+
+                def indexed_warm():
+                    return get_search_results(translation_project, form,
+                                              pootle_path)
+
+                def database():
+                    return list(get_non_indexed_search_step_query(form, units) \
+                                        .values_list('id', flat=True))
+
+                if translation_project.indexer is not None:
+                    for cache, func in (('cold', indexed_cold),
+                                        ('warm', indexed_warm)):
+                        dbids, timings = self.measure(func)
+                        result = dict(base, scope=scope, backend=backend,
+                                      cache=cache, results=len(dbids))
+                        result.update(timings)
+                        yield result
+
+                dbids, timings = self.measure(database)
+                result = dict(base, scope=scope, backend='database',
+                              cache=None, results=len(dbids))
+                result.update(timings)
+                yield result
+
+            # Across all the languages, as the global search does
+            def global_search():
+                for other in translation_projects:
+                    other._update_index_generation()
+                return search_translation_projects(translation_projects, form)
+
+            dbids, timings = self.measure(global_search)
+            result = dict(base, scope='global', backend=backend, cache='cold',
+                          results=len(dbids))
+            result.update(timings)
+            yield result
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import multiprocessing
+import os
+from optparse import make_option
+os.environ['DJANGO_SETTINGS_MODULE'] = 'pootle.settings'
+
+from django.db import connection
+
+from pootle_app.management.commands import PootleCommand
+from pootle_translationproject.models import TranslationProject
+
+
+def build_index(translation_project_id):
+    translation_project = TranslationProject.objects.get(
+            id=translation_project_id)
+    try:
+        return (translation_project.pootle_path,
+                translation_project.build_index() is not None)
+    finally:
+        connection.close()
+
+
+class Command(PootleCommand):
+    help = "Build the text indices of translation projects in parallel."
+
+    option_list = PootleCommand.option_list + (
+        make_option('--processes', dest='processes', type='int',
+                    help='Number of worker processes, defaults to the '
+                         'number of CPU cores'),
+        )
+
+    def handle_noargs(self, **options):
+        self.translation_project_ids = []
+        super(Command, self).handle_noargs(**options)
+
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        ids = self.translation_project_ids
+        if processes > 1 and len(ids) > 1:
+            # Worker processes must not share the database connection
+            connection.close()
+            pool = multiprocessing.Pool(min(processes, len(ids)))
+            try:
+                results = pool.imap_unordered(build_index, ids)
+                self._report(results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self._report(build_index(tp_id) for tp_id in ids)
+
+    def _report(self, results):
+        for pootle_path, built in results:
+            if built:
+                logging.info(u"Built the search index of %s", pootle_path)
+            else:
+                logging.error(u"Could not build the search index of %s",
+                              pootle_path)
+
+    def handle_translation_project(self, translation_project, **options):
+        self.translation_project_ids.append(translation_project.id)
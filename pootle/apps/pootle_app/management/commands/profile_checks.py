@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import os
+os.environ['DJANGO_SETTINGS_MODULE'] = 'pootle.settings'
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from pootle_store.qualitychecks import (get_timings, get_store_timings,
+                                        reset_timings)
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--stores', dest='stores', type='int', default=0,
+                    help='number of slowest files to list'),
+        make_option('--reset', action='store_true', dest='reset',
+                    default=False, help='clear the recorded timings'),
+        )
+    help = "Print the time spent in each quality check."
+
+    def handle_noargs(self, **options):
+        if options.get('reset', False):
+            reset_timings()
+            return
+
+        if not getattr(settings, 'QUALITYCHECK_PROFILING', False):
+            print "QUALITYCHECK_PROFILING is disabled, no new timings will be recorded."
+
+        print "%-20s %-30s %10s %12s %10s" % ("checkstyle", "check", "calls",
+                                              "seconds", "ms/call")
+        for checkstyle, name, calls, seconds in get_timings():
+            print "%-20s %-30s %10d %12.3f %10.3f" % \
+                  (checkstyle, name, calls, seconds,
+                   1000 * seconds / max(calls, 1))
+
+        stores = options.get('stores', 0)
+        if stores:
+            for pootle_path, seconds, timings in get_store_timings(stores):
+                print
+                print "%s: %.3f seconds" % (pootle_path, seconds)
+                for name, (calls, seconds) in timings[:5]:
+                    print "    %-30s %10d %12.3f" % (name, calls, seconds)
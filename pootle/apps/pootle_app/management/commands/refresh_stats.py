@@ -29,8 +29,9 @@ class Command(PootleCommand):
     def handle_translation_project(self, translation_project, **options):
         # This will force the indexer of a TranslationProject to be
         # initialized. The indexer will update the text index of the
-        # TranslationProject if it is out of date.
-        translation_project.indexer
+        # TranslationProject if it is out of date. Use build_indexes to do
+        # this for many translation projects in parallel.
+        translation_project.build_index()
 
     def handle_all_stores(self, translation_project, **options):
         translation_project.getcompletestats()
@@ -21,6 +21,7 @@
 
 import locale
 
+from django.conf import settings
 from django.http import HttpResponse
 from django.utils.translation import ugettext as _
 from django.shortcuts import render_to_response
@@ -36,6 +37,7 @@ from pootle_app.views.admin.util import user_is_admin
 from pootle_misc.aggregate import sum_column
 from pootle_app.models import Suggestion as SuggestionStat
 from pootle_store.models import Unit, Suggestion
+from pootle_store.qualitychecks import get_timings, get_store_timings
 from pootle_profile.models import PootleProfile
 from pootle_store.util import TRANSLATED
 from pootle_statistics.models import Submission
@@ -208,6 +210,28 @@ def server_stats_more(request):
     response = simplejson.dumps(response)
     return HttpResponse(response, mimetype="application/json")
 
+def check_timings():
+    timings = []
+    for checkstyle, name, calls, seconds in get_timings()[:10]:
+        timings.append({
+            'checkstyle': checkstyle,
+            'name': name,
+            'calls': locale.format("%d", calls, grouping=True),
+            'seconds': "%.2f" % seconds,
+            'average': "%.3f" % (1000 * seconds / max(calls, 1)),
+            })
+
+    stores = []
+    for pootle_path, seconds, store_timings in get_store_timings(5):
+        stores.append({
+            'pootle_path': pootle_path,
+            'seconds': "%.2f" % seconds,
+            'checks': ", ".join(name for name, timing in store_timings[:3]),
+            })
+
+    return timings, stores
+
+
 @user_is_admin
 def view(request):
     template_vars = {
@@ -216,4 +240,7 @@ def view(request):
         'optional': optional_depcheck(),
         'optimal': optimal_depcheck(),
         }
+    if getattr(settings, 'QUALITYCHECK_PROFILING', False):
+        template_vars['check_timings'], template_vars['check_stores'] = \
+                check_timings()
     return render_to_response("admin/dashboard.html", template_vars, context_instance=RequestContext(request))
@@ -121,11 +121,13 @@ def get_view_units_dir(request, translation_project, dir_path):
                                  "translation project."))
 
     units_query = translation_project.units
+    pootle_path = translation_project.pootle_path
     if dir_path:
         pootle_path = translation_project.pootle_path + dir_path
         units_query = units_query.filter(store__pootle_path__startswith=pootle_path)
 
-    return get_view_units(request, units_query, store=False)
+    return get_view_units(request, units_query, store=False,
+                          pootle_path=pootle_path)
 
 
 @get_translation_project
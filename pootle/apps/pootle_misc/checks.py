@@ -18,11 +18,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 
-from django.utils.translation import ugettext_lazy as _
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import iri_to_uri
+from django.utils.translation import get_language, ugettext_lazy as _
 
 from translate.filters.decorators import Category
 
 from pootle_app.views.language import dispatch
+from pootle_misc.util import jsonify
 
 
 category_names = {
@@ -78,6 +82,31 @@ check_names = {
 }
 
 
+# Bit of each check in ``Unit.failing_checks``. The bits are stored in the
+# database, so new checks must only ever be appended to this list. Checks
+# missing here are still stored, but can't be filtered without a join.
+check_bits = dict((name, 1 << bit) for bit, name in enumerate([
+    'accelerators', 'acronyms', 'blank', 'brackets', 'compendiumconflicts',
+    'credits', 'dialogsizes', 'doublequoting', 'doublespacing', 'doublewords',
+    'emails', 'endpunc', 'endwhitespace', 'escapes', 'filepaths', 'functions',
+    'gconf', 'isreview', 'kdecomments', 'long', 'musttranslatewords',
+    'newlines', 'notranslatewords', 'nplurals', 'numbers', 'options',
+    'printf', 'puncspacing', 'purepunc', 'sentencecount', 'short',
+    'simplecaps', 'simpleplurals', 'singlequoting', 'spellcheck', 'startcaps',
+    'startpunc', 'startwhitespace', 'tabs', 'unchanged', 'untranslated',
+    'urls', 'validchars', 'variables', 'xmltags',
+]))
+
+
+def get_check_mask(names):
+    """Returns the ``Unit.failing_checks`` bitmask for the check ``names``,
+    ignoring checks without a bit."""
+    mask = 0
+    for name in names:
+        mask |= check_bits.get(name, 0)
+    return mask
+
+
 def get_quality_check_failures(path_obj, path_stats, include_url=True):
     """Returns a list of the failed checks sorted by their importance.
 
@@ -122,3 +151,23 @@ def get_quality_check_failures(path_obj, path_stats, include_url=True):
         pass
 
     return checks
+
+
+def get_quality_check_failures_json(path_obj):
+    """Returns the failed checks of ``path_obj`` as returned by
+    :func:`get_quality_check_failures` without URLs, encoded in JSON.
+
+    The encoded failures are cached per path and language until the
+    complete stats of the path are removed from the cache.
+    """
+    from pootle_misc.stats import get_raw_stats
+
+    key = iri_to_uri(path_obj.pootle_path + ":get_quality_check_failures")
+    failures = cache.get(key) or {}
+    language = get_language()
+    if language not in failures:
+        path_stats = get_raw_stats(path_obj)
+        failures[language] = jsonify(get_quality_check_failures(
+                path_obj, path_stats, include_url=False))
+        cache.set(key, failures, settings.OBJECT_CACHE_TIMEOUT)
+    return failures[language]
@@ -41,33 +41,11 @@ from pootle_misc.dbinit import (stats_start, stats_language, stats_project,
 from pootle_misc.util import deletefromcache
 from pootle_project.models import Project
 from pootle_store.models import Store, QualityCheck, CHECKED, PARSED
+from pootle_store.qualitychecks import start_upgrade_worker
 from pootle_store.util import OBSOLETE
 from pootle_translationproject.models import TranslationProject
 
 
-def flush_quality_checks():
-    """Reverts stores to unchecked state.
-
-    If a store has false positives marked, quality checks will be updated
-    keeping false postivies intact."""
-    for store in Store.objects.filter(state=CHECKED).iterator():
-        store_checks = QualityCheck.objects.filter(unit__store=store)
-        false_positives = store_checks.filter(false_positive=True).count()
-
-        if false_positives:
-            logging.debug("%s has false positives, updating quality checks",
-                          store.pootle_path)
-
-            for unit in store.units.iterator():
-                unit.update_qualitychecks(keep_false_positives=True)
-        else:
-            logging.debug("%s has no false positives, deleting checks",
-                          store.pootle_path)
-            store_checks.delete()
-            store.state = PARSED
-            store.save()
-
-
 def save_toolkit_version(build=None):
     from pootle_misc import siteconfig
     if not build:
@@ -225,6 +203,7 @@ def update_stats_21060():
     for tp in TranslationProject.objects.filter(stores__unit__state=OBSOLETE) \
                                         .distinct().iterator():
         deletefromcache(tp, ["getquickstats", "getcompletestats",
+                             "get_quality_check_failures",
                              "get_mtime", "has_suggestions"])
 
     # There's no need to save the schema version here as it will already be
@@ -251,7 +230,7 @@ def update_ts_tt_12008():
     return text
 
 
-def update_tables_22000(flush_checks):
+def update_tables_22000():
     text = u"""
     <p>%s</p>
     """ % _('Updating existing database tables...')
@@ -332,26 +311,92 @@ def update_tables_22000(flush_checks):
             store.sync_time = last_sync
             store.save()
 
-    if flush_checks:
-        text += """
-        <p>%s</p>
-        """ % _('Removing quality checks, will be recalculated on demand...')
-        logging.info("Fixing quality checks")
-        flush_quality_checks()
-
     save_pootle_version(22000)
 
     return text
 
 
+def update_tables_22001(stamp_checks):
+    """Adds the checker version to stores.
+
+    Quality checks of stores left at version 0 will be upgraded in the
+    background.
+
+    :param stamp_checks: Whether existing quality checks come from the
+        Translate Toolkit version stored in the database.
+    """
+    text = u"""
+    <p>%s</p>
+    """ % _('Updating existing database tables...')
+    logging.info("Updating existing database tables")
+
+    from south.db import db
+
+    table_name = Store._meta.db_table
+    field = Store._meta.get_field('checker_version')
+    db.add_column(table_name, field.name, field)
+
+    if stamp_checks:
+        from pootle_misc import siteconfig
+        from pootle_misc.middleware.siteconfig import DEFAULT_TT_BUILDVERSION
+        config = siteconfig.load_site_config()
+        tt_buildversion = int(config.get('TT_BUILDVERSION',
+                                         DEFAULT_TT_BUILDVERSION))
+        Store.objects.filter(state__gte=CHECKED) \
+                     .update(checker_version=tt_buildversion)
+
+    save_pootle_version(22001)
+
+    return text
+
+
+def update_tables_22002():
+    """Adds the bitmask of failing checks to units."""
+    text = u"""
+    <p>%s</p>
+    """ % _('Updating existing database tables...')
+    logging.info("Updating existing database tables")
+
+    from south.db import db
+
+    from pootle_misc.checks import check_bits
+    from pootle_store.models import Unit
+
+    table_name = Unit._meta.db_table
+    field = Unit._meta.get_field('failing_checks')
+    db.add_column(table_name, field.name, field)
+
+    logging.info("Calculating bitmasks of failing checks")
+    masks = {}
+    for unit_id, name in QualityCheck.objects.filter(false_positive=False) \
+                                             .values_list('unit', 'name') \
+                                             .iterator():
+        masks[unit_id] = masks.get(unit_id, 0) | check_bits.get(name, 0)
+
+    unit_ids = {}
+    for unit_id, mask in masks.iteritems():
+        if mask:
+            unit_ids.setdefault(mask, []).append(unit_id)
+
+    for mask, ids in unit_ids.iteritems():
+        for i in xrange(0, len(ids), 500):
+            Unit.objects.filter(id__in=ids[i:i+500]) \
+                        .update(failing_checks=mask)
+
+    save_pootle_version(22002)
+
+    return text
+
+
 def update_toolkit_version():
     text = """
     <p>%s</p>
-    """ % _('Removing quality checks, will be recalculated on demand...')
-    logging.info("New Translate Toolkit version, flushing quality checks")
+    """ % _('Quality checks will be updated in the background...')
+    logging.info("New Translate Toolkit version, upgrading quality checks")
 
-    flush_quality_checks()
     save_toolkit_version()
+    # Existing checks are served until the worker gets to each store
+    start_upgrade_worker()
 
     return text
 
@@ -498,8 +543,14 @@ def staggered_update(db_buildversion, tt_buildversion):
         save_pootle_version(21000)
 
     if db_buildversion < 22000:
-        flush_checks = not needs_toolkit_upgrade
-        yield update_tables_22000(flush_checks)
+        yield update_tables_22000()
+
+    if db_buildversion < 22001:
+        # Checks from before 22000 lack categories, let them be upgraded
+        yield update_tables_22001(db_buildversion >= 22000)
+
+    if db_buildversion < 22002:
+        yield update_tables_22002()
 
     # Since :func:`update_stats_21060` works with the :cls:`TranslationProject`
     # model, this has to go after upgrading the DB tables, otherwise the model
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Embedded text indexing engine used when neither Xapian nor Lucene are
+available.
+
+The index is an inverted index stored in a SQLite database next to the
+translation files, so it only needs the Python standard library. It
+implements the :class:`translate.search.indexing.CommonIndexer.CommonDatabase`
+interface, so it can be used wherever a toolkit indexer is expected.
+
+Tokenized fields are also indexed by trigrams, which allows
+:meth:`SQLiteDatabase.make_substring_query` to find any substring without
+scanning all the documents.
+"""
+
+import os
+import re
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from translate.search.indexing import CommonIndexer
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Name of the database file inside the index directory
+DATABASE_NAME = "index.db"
+
+# Databases with a different version are rebuilt from scratch
+SCHEMA_VERSION = 2
+
+# Appended to the indexed text, so that every substring shorter than a
+# trigram is the start of some trigram
+TRIGRAM_PADDING = u"\x03\x03"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    docid INTEGER PRIMARY KEY AUTOINCREMENT
+);
+CREATE TABLE IF NOT EXISTS fields (
+    docid INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fields_docid ON fields (docid);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    field TEXT NOT NULL,
+    docid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS terms_term ON terms (term, field);
+CREATE INDEX IF NOT EXISTS terms_docid ON terms (docid);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram TEXT NOT NULL,
+    field TEXT NOT NULL,
+    docid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trigrams_trigram ON trigrams (trigram, field);
+CREATE INDEX IF NOT EXISTS trigrams_docid ON trigrams (docid);
+"""
+
+TABLES = ("documents", "fields", "terms", "trigrams")
+
+
+def is_available():
+    return sqlite3 is not None
+
+
+def tokenize(text):
+    """Split ``text`` into the lowercased terms stored in the index."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def get_trigrams(text):
+    """Return the set of trigrams of ``text``."""
+    return set([text[i:i+3] for i in range(len(text) - 2)])
+
+
+def _contains_substring(value, needle):
+    return needle in value.lower()
+
+
+def _prefix_upper_bound(prefix):
+    """Return the smallest string sorting after every string starting with
+    ``prefix``."""
+    return prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+class SQLiteQuery(object):
+    """A query compiled to a SQL statement selecting matching ``docid``
+    values."""
+
+    def __init__(self, sql, params=()):
+        self.sql = sql
+        self.params = tuple(params)
+
+    def __repr__(self):
+        return "<SQLiteQuery %s %r>" % (self.sql, self.params)
+
+
+MATCH_ALL = SQLiteQuery("SELECT docid FROM documents")
+MATCH_NONE = SQLiteQuery("SELECT docid FROM documents WHERE 0")
+
+
+class SQLiteDatabase(CommonIndexer.CommonDatabase):
+    """Inverted index stored in a SQLite database."""
+
+    QUERY_TYPE = SQLiteQuery
+    INDEX_DIRECTORY_NAME = "sqlite"
+
+    def __init__(self, basedir, analyzer=None, create_allowed=True):
+        super(SQLiteDatabase, self).__init__(basedir, analyzer=analyzer,
+                create_allowed=create_allowed)
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+        # The indexer of a translation project is cached and may be shared
+        # between threads, all access is serialized by the lock
+        self._lock = threading.RLock()
+        self._transaction = False
+        self._conn = sqlite3.connect(os.path.join(self.location,
+                                                  DATABASE_NAME),
+                                     check_same_thread=False)
+        self._conn.create_function("contains_substring", 2,
+                                   _contains_substring)
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            for table in TABLES:
+                self._conn.execute("DROP TABLE IF EXISTS %s" % table)
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        self._lock.acquire()
+        try:
+            return self._conn.execute(sql, params).fetchall()
+        finally:
+            self._lock.release()
+
+    def _autocommit(self):
+        if not self._transaction:
+            self._conn.commit()
+
+    def flush(self, optimize=False):
+        self._lock.acquire()
+        try:
+            self._conn.commit()
+            if optimize:
+                self._conn.execute("ANALYZE")
+        finally:
+            self._lock.release()
+
+    def begin_transaction(self):
+        self._lock.acquire()
+        self._transaction = True
+
+    def commit_transaction(self):
+        try:
+            self._conn.commit()
+        finally:
+            self._end_transaction()
+
+    def cancel_transaction(self):
+        try:
+            self._conn.rollback()
+        finally:
+            self._end_transaction()
+
+    def _end_transaction(self):
+        if self._transaction:
+            self._transaction = False
+            self._lock.release()
+
+    ############################################################################
+    # Queries
+
+    def _create_query_for_query(self, query):
+        # Queries are immutable, there is no need for a copy
+        return query
+
+    def _term_query(self, term, field, partial):
+        conditions = []
+        params = []
+        if partial and term:
+            conditions.append("term >= ? AND term < ?")
+            params.extend([term, _prefix_upper_bound(term)])
+        else:
+            conditions.append("term = ?")
+            params.append(term)
+        if field is not None:
+            conditions.append("field = ?")
+            params.append(field)
+        return SQLiteQuery("SELECT DISTINCT docid FROM terms WHERE %s" %
+                           " AND ".join(conditions), params)
+
+    def _analyzed_query(self, text, field, analyzer, require_all=True):
+        partial = (analyzer & self.ANALYZER_PARTIAL) > 0
+        if (analyzer & self.ANALYZER_TOKENIZE) > 0:
+            queries = [self._term_query(term, field, partial)
+                       for term in tokenize(text)]
+            if not queries:
+                # Only punctuation, which is not indexed
+                return MATCH_NONE
+            return self._create_query_combined(queries, require_all)
+        return self._term_query(text, field, partial)
+
+    def _create_query_for_string(self, text, require_all=True,
+                                 analyzer=None):
+        if analyzer is None:
+            analyzer = self.analyzer
+        return self._analyzed_query(text, None, analyzer, require_all)
+
+    def _create_query_for_field(self, field, value, analyzer=None):
+        if analyzer is None:
+            analyzer = self.get_field_analyzers(field)
+        return self._analyzed_query(value, field, analyzer)
+
+    def _create_query_combined(self, queries, require_all=True):
+        if not queries:
+            if require_all:
+                return MATCH_ALL
+            return MATCH_NONE
+        if len(queries) == 1:
+            return queries[0]
+        operator = require_all and " INTERSECT " or " UNION "
+        params = []
+        for query in queries:
+            params.extend(query.params)
+        return SQLiteQuery(operator.join(["SELECT docid FROM (%s)" % query.sql
+                                          for query in queries]), params)
+
+    def make_substring_query(self, field, text):
+        """Create a query for the documents whose ``field`` contains
+        ``text``, ignoring case.
+
+        The trigram index narrows down the candidates, which are then
+        checked against the stored field values.
+        """
+        needle = self._decode(text).lower()
+        if not needle:
+            return MATCH_ALL
+        field = self._decode(field)
+        if len(needle) == 1:
+            # Most documents contain any given character, checking them
+            # all is faster than going through the trigrams
+            return SQLiteQuery("SELECT DISTINCT docid FROM fields "
+                               "WHERE field = ? "
+                               "AND contains_substring(value, ?)",
+                               [field, needle])
+        elif len(needle) == 2:
+            candidates = SQLiteQuery("SELECT docid FROM trigrams "
+                                     "WHERE trigram >= ? AND trigram < ? "
+                                     "AND field = ?",
+                                     [needle, _prefix_upper_bound(needle),
+                                      field])
+        else:
+            candidates = self._create_query_combined(
+                    [SQLiteQuery("SELECT docid FROM trigrams "
+                                 "WHERE trigram = ? AND field = ?",
+                                 [trigram, field])
+                     for trigram in sorted(get_trigrams(needle))], True)
+        return SQLiteQuery("SELECT DISTINCT docid FROM fields "
+                           "WHERE field = ? AND docid IN (%s) "
+                           "AND contains_substring(value, ?)" % candidates.sql,
+                           (field,) + candidates.params + (needle,))
+
+    ############################################################################
+    # Documents
+
+    def _create_empty_document(self):
+        return {'fields': [], 'terms': set(), 'trigrams': set()}
+
+    def _add_plain_term(self, document, term, tokenize_term=True):
+        if (self.analyzer & self.ANALYZER_TOKENIZE) > 0:
+            for token in tokenize(term):
+                document['terms'].add((token, u""))
+        else:
+            document['terms'].add((term, u""))
+
+    def _add_field_term(self, document, field, term, tokenize_term=True):
+        # The toolkit computes ``tokenize_term`` with a wrong operator
+        # precedence, use the configured analyzer instead
+        field = self._decode(field)
+        document['fields'].append((field, term))
+        if (self.get_field_analyzers(field) & self.ANALYZER_TOKENIZE) > 0:
+            for token in tokenize(term):
+                document['terms'].add((token, field))
+            for trigram in get_trigrams(term.lower() + TRIGRAM_PADDING):
+                document['trigrams'].add((trigram, field))
+        else:
+            document['terms'].add((term, field))
+
+    def _add_document_to_index(self, document):
+        self._lock.acquire()
+        try:
+            cursor = self._conn.execute("INSERT INTO documents DEFAULT VALUES")
+            docid = cursor.lastrowid
+            self._conn.executemany(
+                    "INSERT INTO fields (docid, field, value) VALUES (?, ?, ?)",
+                    [(docid, field, value)
+                     for field, value in document['fields']])
+            self._conn.executemany(
+                    "INSERT INTO terms (term, field, docid) VALUES (?, ?, ?)",
+                    [(term, field, docid)
+                     for term, field in document['terms']])
+            self._conn.executemany(
+                    "INSERT INTO trigrams (trigram, field, docid) "
+                    "VALUES (?, ?, ?)",
+                    [(trigram, field, docid)
+                     for trigram, field in document['trigrams']])
+            self._autocommit()
+        finally:
+            self._lock.release()
+
+    def delete_document_by_id(self, docid):
+        return self._delete(SQLiteQuery("SELECT ?", [docid])) > 0
+
+    def delete_doc(self, ident):
+        if isinstance(ident, list):
+            ident_list = ident
+        else:
+            ident_list = [ident]
+        if not ident_list or isinstance(ident_list[0], int):
+            return super(SQLiteDatabase, self).delete_doc(ident_list)
+        if isinstance(ident_list[0], dict):
+            query = self.make_query([self.make_query(query_dict,
+                    require_all=True) for query_dict in ident_list],
+                    require_all=True)
+        else:
+            query = self.make_query(ident_list, require_all=True)
+        # Delete all matches at once instead of walking them one by one
+        return self._delete(query)
+
+    def _delete(self, query):
+        self._lock.acquire()
+        try:
+            docids = [row[0] for row in
+                      self._conn.execute(query.sql, query.params).fetchall()]
+            for start in range(0, len(docids), 500):
+                chunk = [(docid,) for docid in docids[start:start + 500]]
+                for table in TABLES:
+                    self._conn.executemany("DELETE FROM %s WHERE docid = ?" %
+                                           table, chunk)
+            self._autocommit()
+            return len(docids)
+        finally:
+            self._lock.release()
+
+    ############################################################################
+    # Results
+
+    def get_query_result(self, query):
+        return SQLiteEnquire((self, query))
+
+    def _get_fields(self, docids, fieldnames=None):
+        """Return a mapping of each docid to its stored fields."""
+        documents = dict((docid, {}) for docid in docids)
+        for start in range(0, len(docids), 500):
+            chunk = docids[start:start + 500]
+            sql = "SELECT docid, field, value FROM fields WHERE docid IN (%s)" \
+                    % ", ".join(["?"] * len(chunk))
+            params = list(chunk)
+            if fieldnames is not None:
+                sql += " AND field IN (%s)" % ", ".join(["?"] * len(fieldnames))
+                params.extend(fieldnames)
+            for docid, field, value in self._execute(sql, params):
+                documents[docid].setdefault(field, []).append(value)
+        return documents
+
+    def search(self, query, fieldnames):
+        if isinstance(fieldnames, basestring):
+            fieldnames = [fieldnames]
+        docids = [row[0] for row in self._execute(
+                "SELECT docid FROM (%s) ORDER BY docid" % query.sql,
+                query.params)]
+        documents = self._get_fields(docids, fieldnames)
+        result = []
+        for docid in docids:
+            document = documents[docid]
+            result.append(dict((field, document.get(field, []))
+                               for field in fieldnames))
+        return result
+
+
+    def iter_values(self, query, fieldname, order_by=(), batch_size=1000):
+        """Yield the first value of ``fieldname`` of every match of
+        ``query``, reading ``batch_size`` rows from the database at a time.
+
+        Matches are sorted by the values of the ``order_by`` fields, numbers
+        in numeric order. The database stays locked until the iteration is
+        over, so consume the values right away.
+        """
+        value_sql = "(SELECT value FROM fields WHERE docid = matches.docid " \
+                    "AND field = ? LIMIT 1)"
+        columns = [value_sql] + [value_sql] * len(order_by)
+        order = []
+        for i in range(len(order_by)):
+            order.append("CAST(col%d AS INTEGER), col%d" % (i + 1, i + 1))
+        sql = "SELECT %s FROM (%s) AS matches" % (
+                ", ".join(["%s AS col%d" % (column, i)
+                           for i, column in enumerate(columns)]),
+                query.sql)
+        if order:
+            sql += " ORDER BY " + ", ".join(order)
+        params = (fieldname,) + tuple(order_by) + query.params
+
+        self._lock.acquire()
+        try:
+            cursor = self._conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0]
+        finally:
+            self._lock.release()
+
+
+class SQLiteEnquire(CommonIndexer.CommonEnquire):
+    """Access to the matches of a :class:`SQLiteQuery`."""
+
+    def get_matches(self, start, number):
+        database, query = self.enquire
+        count = self.get_matches_count()
+        docids = [row[0] for row in database._execute(
+                "SELECT docid FROM (%s) ORDER BY docid LIMIT ? OFFSET ?" %
+                query.sql, query.params + (number, start))]
+        documents = database._get_fields(docids)
+        matches = []
+        for docid in docids:
+            matches.append({
+                "rank": start + len(matches),
+                "percent": 100,
+                "document": documents[docid],
+                "docid": docid,
+            })
+        return (len(matches), count, matches)
+
+    def get_matches_count(self):
+        database, query = self.enquire
+        return database._execute("SELECT COUNT(*) FROM (%s)" % query.sql,
+                                 query.params)[0][0]
@@ -19,14 +19,25 @@
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import time
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.utils import simplejson
 from django.utils.encoding import iri_to_uri
 
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5
+    StreamingHttpResponse = None
+
+
+#: Approximate size of the chunks of streamed JSON responses
+JSON_CHUNK_SIZE = 16384
+
 
 def getfromcache(function, timeout=settings.OBJECT_CACHE_TIMEOUT):
     def _getfromcache(instance, *args, **kwargs):
@@ -56,10 +67,66 @@ def deletefromcache(sender, functions, **kwargs):
         path_parts = path_parts[:-1]
         path = "/".join(path_parts) + "/"
 
+def _new_generation():
+    return int(time.time() * 1000)
+
+def get_generation(key):
+    """Returns the counter stored in the cache under ``key``, to be used in
+    the cache keys of what depends on it.
+
+    Counters start from the current time in milliseconds rather than from
+    zero, so that a counter which expired or was evicted from the cache
+    never comes back to a value that cached entries were keyed on.
+    """
+    generation = cache.get(key)
+    if generation is None:
+        generation = _new_generation()
+        if not cache.add(key, generation, settings.OBJECT_CACHE_TIMEOUT):
+            generation = cache.get(key, generation)
+    return generation
+
+def get_generations(keys):
+    """Same as :func:`get_generation` for all of ``keys`` at once.
+
+    :return: A dictionary of counters keyed by cache key.
+    """
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            generations[key] = get_generation(key)
+    return generations
+
+def update_generation(key):
+    """Increases the counter stored in the cache under ``key``."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Past any value the counter had before it left the cache
+        cache.set(key, _new_generation() + 1, settings.OBJECT_CACHE_TIMEOUT)
+
 def dictsum(x, y):
     return dict((n, x.get(n, 0)+y.get(n, 0)) for n in set(x)|set(y))
 
 
+def bulk_create(model, objs, batch_size=100):
+    """Inserts ``objs`` into ``model``'s table using multi-row inserts.
+
+    As with Django's ``bulk_create``, no ``save`` methods or signals are
+    called and primary keys are not set on the given objects. Django
+    versions lacking ``bulk_create`` fall back to saving objects one by one.
+    """
+    manager = model._default_manager
+
+    if not hasattr(manager, 'bulk_create'):
+        for obj in objs:
+            obj.save()
+        return
+
+    # Batches keep us below the bound parameters limit of some backends
+    for i in xrange(0, len(objs), batch_size):
+        manager.bulk_create(objs[i:i+batch_size])
+
+
 def paginate(request, queryset, items=30, page=None):
     paginator = Paginator(queryset, items)
 
@@ -106,6 +173,42 @@ def jsonify(json):
     return simplejson.dumps(json, indent=indent)
 
 
+def iterjsonify(json):
+    """Encodes ``json`` like :func:`jsonify`, as a generator of strings of
+    about ``JSON_CHUNK_SIZE`` characters."""
+    if settings.DEBUG:
+        indent = 4
+    else:
+        indent = None
+
+    chunks = []
+    size = 0
+    for chunk in simplejson.JSONEncoder(indent=indent).iterencode(json):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= JSON_CHUNK_SIZE:
+            yield "".join(chunks)
+            chunks = []
+            size = 0
+    if chunks:
+        yield "".join(chunks)
+
+
+def json_response(json, status=200):
+    """Returns a response with ``json`` encoded as it is sent, so that the
+    whole encoded string is never held in memory.
+
+    Responses are only streamed from Django 1.5 on. Older versions let
+    middleware read the content of responses, so they get the string
+    from :func:`jsonify` instead.
+    """
+    if StreamingHttpResponse is not None:
+        return StreamingHttpResponse(iterjsonify(json), status=status,
+                                     content_type="application/json")
+    return HttpResponse(jsonify(json), status=status,
+                        mimetype="application/json")
+
+
 def ajax_required(f):
     """
     AJAX request required decorator
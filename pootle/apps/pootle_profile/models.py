@@ -26,11 +26,12 @@ from django.db.models import Q
 from django.contrib.auth.models import User, UserManager, AnonymousUser
 from django.utils.html import simple_email_re as email_re
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save
 
 from pootle.i18n.override import lang_choices
 from pootle_misc.baseurl import l
-from pootle_misc.util import cached_property
+from pootle_misc.util import (cached_property, get_generation,
+                              update_generation)
 
 from translate.misc.hash import md5_f
 
@@ -165,6 +166,36 @@ def create_pootle_profile(sender, instance, **kwargs):
 
 post_save.connect(create_pootle_profile, sender=User)
 
+def _get_alt_src_langs_generation_key(profile_id):
+    return "alt_src_langs_generation:%d" % profile_id
+
+def get_alt_src_langs_generation(profile_id):
+    """Returns a counter that changes whenever the alternative source
+    languages of the profile with id ``profile_id`` change, to be used in
+    the cache keys of their resolution."""
+    return get_generation(_get_alt_src_langs_generation_key(profile_id))
+
+def update_alt_src_langs_generation(profile_id):
+    update_generation(_get_alt_src_langs_generation_key(profile_id))
+
+def alt_src_langs_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """A m2m_changed hook for the alternative source languages of
+    profiles, which invalidates their cached resolution."""
+    if reverse:
+        # Changed from the side of a language
+        if action == 'pre_clear':
+            pk_set = instance.user_alt_src_langs.values_list('id', flat=True)
+        elif action not in ('post_add', 'post_remove'):
+            return
+        for profile_id in pk_set:
+            update_alt_src_langs_generation(profile_id)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        update_alt_src_langs_generation(instance.id)
+
+m2m_changed.connect(alt_src_langs_changed,
+                    sender=PootleProfile.alt_src_langs.through)
+
 def get_profile(user):
     """Return the PootleProfile associated with a user.
 
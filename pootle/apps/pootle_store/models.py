@@ -28,7 +28,6 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import FileSystemStorage
 from django.db import models, IntegrityError
 from django.db.models.signals import post_delete
-from django.db.transaction import commit_on_success
 from django.utils.translation import ugettext_lazy as _
 
 from translate.filters.decorators import Category
@@ -38,13 +37,18 @@ from translate.storage import base
 from pootle_app.lib.util import RelatedManager
 from pootle_misc.aggregate import group_by_count_extra, max_column
 from pootle_misc.baseurl import l
-from pootle_misc.checks import check_names
-from pootle_misc.util import cached_property, getfromcache, deletefromcache
+from pootle_misc.checks import check_bits, check_names, get_check_mask
+from pootle_misc.util import (bulk_create, cached_property, getfromcache,
+                              deletefromcache)
 from pootle_store.fields import (TranslationStoreField, MultiStringField,
                                  PLURAL_PLACEHOLDER, SEPARATOR)
 from pootle_store.filetypes import factory_classes, is_monolingual
+from pootle_store.qualitychecks import CHECKER_VERSION
 from pootle_store.util import (calculate_stats, empty_quickstats,
+                               update_units_generation,
                                OBSOLETE, UNTRANSLATED, FUZZY, TRANSLATED)
+from pootle_translationproject.indexqueue import (commit_on_success,
+                                                   queue_units)
 
 
 #
@@ -79,6 +83,82 @@ class QualityCheck(models.Model):
         return check_names.get(self.name, self.name)
 
 
+def update_qualitycheck_rows(queryset, failures, keep_false_positives=False):
+    """Makes the quality checks in ``queryset`` match ``failures``, only
+    deleting, inserting or updating the rows that actually changed.
+
+    :param failures: Dictionary mapping unit ids to lists of
+        ``(name, message, category)`` tuples. Checks in ``queryset`` of units
+        not in ``failures`` are deleted.
+    :param keep_false_positives: Whether to keep the checks marked as false
+        positives, even if they don't fail anymore. Otherwise their flag is
+        reset if they still fail.
+    :return: Dictionary mapping the ids of the units with failures or
+        existing checks to their new ``failing_checks`` bitmask.
+    """
+    existing = {}
+    for row in queryset.values_list('id', 'unit', 'name', 'message',
+                                    'category', 'false_positive'):
+        existing[(row[1], row[2])] = row
+
+    new_checks = []
+    reset_false_positives = []
+    masks = {}
+    for unit_id, unit_failures in failures.iteritems():
+        masks[unit_id] = 0
+        for name, message, category in unit_failures:
+            row = existing.pop((unit_id, name), None)
+            if row is None:
+                new_checks.append(QualityCheck(unit_id=unit_id, name=name,
+                                               message=message,
+                                               category=category))
+                masks[unit_id] |= check_bits.get(name, 0)
+                continue
+
+            check_id, false_positive = row[0], row[5]
+            if (message, category) != (row[3], row[4]):
+                QualityCheck.objects.filter(id=check_id) \
+                                    .update(message=message, category=category)
+            if false_positive and not keep_false_positives:
+                reset_false_positives.append(check_id)
+            if not (false_positive and keep_false_positives):
+                masks[unit_id] |= check_bits.get(name, 0)
+
+    # Whatever is left doesn't fail anymore
+    stale_checks = []
+    for check in existing.itervalues():
+        masks.setdefault(check[1], 0)
+        if not (keep_false_positives and check[5]):
+            stale_checks.append(check[0])
+
+    for i in xrange(0, len(stale_checks), 500):
+        QualityCheck.objects.filter(id__in=stale_checks[i:i+500]).delete()
+    for i in xrange(0, len(reset_false_positives), 500):
+        QualityCheck.objects.filter(id__in=reset_false_positives[i:i+500]) \
+                            .update(false_positive=False)
+    bulk_create(QualityCheck, new_checks)
+
+    return masks
+
+
+def update_failing_checks(masks, current_masks):
+    """Stores the ``masks`` of ``Unit.failing_checks`` that differ from
+    ``current_masks``, with one statement per distinct bitmask.
+
+    Units in ``current_masks`` that are missing from ``masks`` are reset.
+    """
+    changed = {}
+    for unit_id in set(masks) | set(current_masks):
+        mask = masks.get(unit_id, 0)
+        if mask != current_masks.get(unit_id, 0):
+            changed.setdefault(mask, []).append(unit_id)
+
+    for mask, unit_ids in changed.iteritems():
+        for i in xrange(0, len(unit_ids), 500):
+            Unit.objects.filter(id__in=unit_ids[i:i+500]) \
+                        .update(failing_checks=mask)
+
+
 ################# Suggestion ################
 
 class SuggestionManager(RelatedManager):
@@ -202,6 +282,10 @@ class Unit(models.Model, base.TranslationUnit):
 
     state = models.IntegerField(null=False, default=UNTRANSLATED, db_index=True)
 
+    # Bitmask of the failing quality checks, see pootle_misc.checks.check_bits
+    failing_checks = models.BigIntegerField(null=False, default=0,
+                                            db_index=True, editable=False)
+
     # Metadata
     mtime = models.DateTimeField(auto_now=True, auto_now_add=True,
                                  db_index=True, editable=False)
@@ -231,8 +315,16 @@ class Unit(models.Model, base.TranslationUnit):
         self._rich_target = None
         self._target_updated = False
         self._encoding = 'UTF-8'
+        self._saved_position = self._get_position()
+
+    def _get_position(self):
+        """Returns what decides whether and where filtered unit views list
+        this unit."""
+        return (self.store_id, self.index, self.state, self.failing_checks)
 
     def save(self, *args, **kwargs):
+        created = self.id is None
+
         if self._source_updated:
             # update source related fields
             self.source_hash = md5_f(self.source_f.encode("utf-8")).hexdigest()
@@ -266,13 +358,19 @@ class Unit(models.Model, base.TranslationUnit):
         self._source_updated = False
         self._target_updated = False
 
+        position = self._get_position()
         if self.store.state >= PARSED:
             # updated caches
             store = self.store
-            #translation_project = store.translation_project
-            #translation_project.update_index(translation_project.indexer, store, self.id)
+            queue_units(store.translation_project_id, [self.id])
+            if created or position != self._saved_position:
+                # Cached unit ids only change when units are added, moved,
+                # or change their state or failing checks
+                update_units_generation(store.translation_project_id)
             deletefromcache(store, ["getquickstats", "getcompletestats",
+                                    "get_quality_check_failures",
                                     "get_mtime", "get_suggestion_count"])
+        self._saved_position = position
 
     def _get_source(self):
         return self.source_f
@@ -467,33 +565,34 @@ class Unit(models.Model, base.TranslationUnit):
 
     def update_qualitychecks(self, created=False, keep_false_positives=False):
         """Run quality checks and store result in the database."""
-        existing = []
-
-        if not created:
-            checks = self.qualitycheck_set.all()
-
-            if keep_false_positives:
-                existing = set(checks.filter(false_positive=True) \
-                                     .values_list('name', flat=True))
-                checks = checks.filter(false_positive=False)
-
-            checks.delete()
-
-        if not self.target:
-            return
-
-        qc_failures = self.store.translation_project.checker. \
-                run_filters(self, categorised=True)
-
-        for name in qc_failures.iterkeys():
-            if name == 'isfuzzy' or name in existing:
-                continue
+        runner = self.store.translation_project.get_qualitycheck_runner(1)
+        results = runner.run([self], self.store.pootle_path)
+        # Untranslated units are not checked
+        failures = results and results[0][1] or []
+
+        if created:
+            # No existing checks to compare with
+            bulk_create(QualityCheck, [QualityCheck(unit=self, name=name,
+                                                    message=message,
+                                                    category=category)
+                                       for name, message, category in failures])
+            mask = get_check_mask([failure[0] for failure in failures])
+        else:
+            masks = update_qualitycheck_rows(self.qualitycheck_set.all(),
+                                             {self.id: failures},
+                                             keep_false_positives)
+            mask = masks[self.id]
 
-            message = qc_failures[name]['message']
-            category = qc_failures[name]['category']
+        if mask != self.failing_checks:
+            update_failing_checks({self.id: mask},
+                                  {self.id: self.failing_checks})
+            self.failing_checks = mask
 
-            self.qualitycheck_set.create(name=name, message=message,
-                                         category=category)
+    def refresh_failing_checks(self):
+        """Recalculates ``failing_checks`` from the stored quality checks,
+        e.g. after marking some as false positives."""
+        self.failing_checks = get_check_mask(
+                self.get_qualitychecks().values_list('name', flat=True))
 
 
     def get_qualitychecks(self):
@@ -658,13 +757,21 @@ class Unit(models.Model, base.TranslationUnit):
 
         suggestion = Suggestion(unit=self, user=user)
         suggestion.target = translation
+
+        if self.suggestion_set.filter(target_hash=suggestion.target_hash) \
+                              .exists():
+            # duplicate suggestion
+            return None
+
         try:
             suggestion.save()
-            if touch:
-                self.save()
-        except:
-            # probably duplicate suggestion
+        except IntegrityError:
+            # duplicate suggestion added concurrently
             return None
+
+        update_units_generation(self.store.translation_project_id)
+        if touch:
+            self.save()
         return suggestion
 
 
@@ -681,6 +788,7 @@ class Unit(models.Model, base.TranslationUnit):
         # ``save``, otherwise the quality checks won't be properly updated
         # when saving the unit.
         suggestion.delete()
+        update_units_generation(self.store.translation_project_id)
         self.save()
 
         if settings.AUTOSYNC and self.file:
@@ -699,6 +807,7 @@ class Unit(models.Model, base.TranslationUnit):
             return False
 
         suggestion.delete()
+        update_units_generation(self.store.translation_project_id)
         # Update timestamp
         self.save()
 
@@ -748,6 +857,7 @@ class Store(models.Model, base.TranslationStore):
     name = models.CharField(max_length=128, null=False, editable=False)
     sync_time = models.DateTimeField(default=datetime.datetime.min)
     state = models.IntegerField(null=False, default=NEW, editable=False, db_index=True)
+    checker_version = models.IntegerField(null=False, default=0, editable=False)
 
     def natural_key(self):
         return (self.pootle_path,)
@@ -768,12 +878,16 @@ class Store(models.Model, base.TranslationStore):
                 #self.translation_project.update_index(self.translation_project.indexer, self)
             # new units, let's flush cache
             deletefromcache(self, ["getquickstats", "getcompletestats",
+                                   "get_quality_check_failures",
                                    "get_mtime", "get_suggestion_count"])
+            update_units_generation(self.translation_project_id)
 
     def delete(self, *args, **kwargs):
         super(Store, self).delete(*args, **kwargs)
         deletefromcache(self, ["getquickstats", "getcompletestats",
+                               "get_quality_check_failures",
                                "get_mtime", "get_suggestion_count"])
+        update_units_generation(self.translation_project_id)
 
     @getfromcache
     def get_mtime(self):
@@ -966,13 +1080,18 @@ class Store(models.Model, base.TranslationStore):
             if update_structure:
                 obsolete_dbids = [self.dbid_index.get(uid) \
                     for uid in old_ids - new_ids]
+                deleted_ids = []
                 for unit in self.findid_bulk(obsolete_dbids):
                     if not unit.istranslated():
+                        deleted_ids.append(unit.id)
                         unit.delete()
                     elif not conservative:
                         #FIXME: make obsolete instead?
                         unit.makeobsolete()
                         unit.save()
+                queue_units(self.translation_project_id, deleted_ids)
+                if deleted_ids:
+                    update_units_generation(self.translation_project_id)
 
                 new_units = (store.findid(uid) for uid in new_ids - old_ids)
                 for unit in new_units:
@@ -1022,22 +1141,48 @@ class Store(models.Model, base.TranslationStore):
             self.save()
 
 
-    def require_qualitychecks(self):
+    def require_qualitychecks(self, runner=None):
         """make sure quality checks are run"""
         if self.state < CHECKED:
-            self.update_qualitychecks()
+            self.update_qualitychecks(runner=runner)
             # new qualitychecks, let's flush cache
-            deletefromcache(self, ["getcompletestats"])
+            deletefromcache(self, ["getcompletestats",
+                                   "get_quality_check_failures"])
 
     @commit_on_success
-    def update_qualitychecks(self):
+    def update_qualitychecks(self, runner=None, keep_false_positives=False):
+        """Run quality checks on all units and store the results in the
+        database.
+
+        :param runner: :class:`~pootle_store.qualitychecks.QualityCheckRunner`
+            to use. If not given, one is created for this store only.
+        :param keep_false_positives: Whether to keep the checks marked as
+            false positives.
+        """
         logging.debug(u"Updating quality checks for %s", self.pootle_path)
-        for unit in self.units.iterator():
-            unit.update_qualitychecks()
+        own_runner = runner is None
+        if own_runner:
+            runner = self.translation_project.get_qualitycheck_runner()
 
+        try:
+            failures = dict(runner.run(self.units.iterator(),
+                                       self.pootle_path))
+        finally:
+            if own_runner:
+                runner.close()
+
+        checks = QualityCheck.objects.filter(unit__store=self,
+                                             unit__state__gt=OBSOLETE)
+        masks = update_qualitycheck_rows(checks, failures,
+                                         keep_false_positives)
+        current_masks = dict(self.units.filter(failing_checks__gt=0)
+                                       .values_list('id', 'failing_checks'))
+        update_failing_checks(masks, current_masks)
+
+        self.checker_version = CHECKER_VERSION
         if self.state < CHECKED:
             self.state = CHECKED
-            self.save()
+        self.save()
 
     def sync(self, update_structure=False, update_translation=False,
              conservative=True, create=False, profile=None, skip_missing=False):
@@ -1294,6 +1439,67 @@ class Store(models.Model, base.TranslationStore):
         """Returns a single unit based on the item number."""
         return self.units[item]
 
+    def add_suggestions(self, suggestions, touch=True):
+        """Adds suggestions for units of this store in bulk.
+
+        Duplicates are detected by looking up ``(unit, target_hash)`` pairs
+        in chunks, and only new suggestions get inserted.
+
+        :param suggestions: Iterable of ``(unit, translation, user)`` tuples.
+        :param touch: Whether to update the modification time of units
+                      which got new suggestions.
+        :return: A tuple of ``(added, duplicates)`` lists of
+                 :cls:`Suggestion` objects. Added suggestions don't have
+                 their primary keys set.
+        """
+        candidates = {}
+        keys = []
+        duplicates = []
+
+        for unit, translation, user in suggestions:
+            if not filter(None, translation) or translation == unit.target:
+                continue
+
+            suggestion = Suggestion(unit=unit, user=user)
+            suggestion.target = translation
+
+            key = (unit.id, suggestion.target_hash)
+            if key in candidates:
+                duplicates.append(suggestion)
+            else:
+                candidates[key] = suggestion
+                keys.append(key)
+
+        existing = set()
+        chunks = 200
+        for i in xrange(0, len(keys), chunks):
+            chunk = keys[i:i+chunks]
+            existing.update(Suggestion.objects.filter(
+                    unit__in=set(unit_id for unit_id, h in chunk),
+                    target_hash__in=set(h for unit_id, h in chunk),
+                ).values_list('unit', 'target_hash'))
+
+        added = []
+        for key in keys:
+            if key in existing:
+                duplicates.append(candidates[key])
+            else:
+                added.append(candidates[key])
+
+        bulk_create(Suggestion, added)
+
+        if added:
+            if touch:
+                mtime = datetime.datetime.now()
+                unit_ids = list(set(s.unit_id for s in added))
+                for i in xrange(0, len(unit_ids), chunks):
+                    Unit.objects.filter(id__in=unit_ids[i:i+chunks]) \
+                                .update(mtime=mtime)
+            deletefromcache(self, ["get_mtime", "get_suggestion_count"])
+            update_units_generation(self.translation_project_id)
+
+        return added, duplicates
+
     @commit_on_success
     def mergefile(self, newfile, profile, allownewstrings, suggestions,
                   notranslate, obsoletemissing):
@@ -1355,15 +1561,21 @@ class Store(models.Model, base.TranslationStore):
             if obsoletemissing:
                 obsolete_dbids = [self.dbid_index.get(uid) \
                                   for uid in old_ids - new_ids]
+                deleted_ids = []
                 for unit in self.findid_bulk(obsolete_dbids):
                     if unit.istranslated():
                         unit.makeobsolete()
                         unit.save()
                     else:
+                        deleted_ids.append(unit.id)
                         unit.delete()
+                queue_units(self.translation_project_id, deleted_ids)
+                if deleted_ids:
+                    update_units_generation(self.translation_project_id)
 
             shared_dbids = [self.dbid_index.get(uid) \
                             for uid in old_ids & new_ids]
+            new_suggestions = []
             for oldunit in self.findid_bulk(shared_dbids):
                 newunit = newfile.findid(oldunit.getid())
 
@@ -1375,7 +1587,8 @@ class Store(models.Model, base.TranslationStore):
                     if (notranslate or suggestions and
                         oldunit.istranslated() and
                         (not mtime or mtime < oldunit.mtime)):
-                        oldunit.add_suggestion(newunit.target, profile)
+                        new_suggestions.append((oldunit, newunit.target,
+                                                profile))
                     else:
                         changed = oldunit.merge(newunit, overwrite=True)
                         if changed:
@@ -1386,6 +1599,8 @@ class Store(models.Model, base.TranslationStore):
                             if do_checks and old_state >= CHECKED:
                                 oldunit.update_qualitychecks()
 
+            self.add_suggestions(new_suggestions)
+
             if allownewstrings or obsoletemissing:
                 self.sync(update_structure=True, update_translation=True,
                           conservative=False, create=False, profile=profile)
@@ -1473,14 +1688,16 @@ class Store(models.Model, base.TranslationStore):
         if not self.pending:
             return
 
+        new_suggestions = []
         for sugg in [sugg for sugg in self.pending.store.units if sugg.istranslatable() and sugg.istranslated()]:
             if not sugg.istranslatable() or not sugg.istranslated():
                 continue
             unit = self.findunit(sugg.source)
             if unit:
                 suggester = self.getsuggester_from_pending(sugg)
-                unit.add_suggestion(sugg.target, suggester, touch=False)
+                new_suggestions.append((unit, sugg.target, suggester))
                 self.pending.store.units.remove(sugg)
+        self.add_suggestions(new_suggestions, touch=False)
         if len(self.pending.store.units) >  1:
             self.pending.savestore()
         else:
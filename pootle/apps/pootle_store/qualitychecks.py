@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Batch execution of quality checks, optionally in worker processes."""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, get_cache
+
+from translate.__version__ import build as toolkit_build
+from translate.filters import checks
+from translate.misc.hash import md5_f
+from translate.misc.multistring import multistring
+
+
+# Below this number of units, starting worker processes costs more than
+# running the checks in the current process
+MIN_POOL_BATCH = 100
+
+# Number of units sent to a worker process at once
+POOL_CHUNKSIZE = 50
+
+# Number of results fetched from or stored in the results cache at once
+CACHE_BATCH = 500
+
+# Version of the checks stored in the database. Stores checked with an older
+# version are upgraded in the background, see start_upgrade_worker
+CHECKER_VERSION = toolkit_build
+
+# Cache key preventing several upgrade workers from running at once, and the
+# number of seconds after which it expires if a worker dies silently
+UPGRADE_LOCK_KEY = "qualitychecks:upgrade_lock"
+UPGRADE_LOCK_TIMEOUT = 3600
+
+# Cache keys of the timings recorded when QUALITYCHECK_PROFILING is enabled,
+# and the number of slowest stores to keep timings for
+TIMINGS_KEY = "qualitychecks:timings"
+STORE_TIMINGS_KEY = "qualitychecks:store_timings"
+MAX_STORE_TIMINGS = 100
+
+
+def get_results_cache():
+    """Returns the cache used to memoize check results.
+
+    A separate ``qualitychecks`` cache is used if configured in
+    ``settings.CACHES``, so check results don't push other entries out of the
+    default cache.
+    """
+    if 'qualitychecks' in getattr(settings, 'CACHES', {}):
+        return get_cache('qualitychecks')
+    return cache
+
+
+def filtererrorhandler(functionname, str1, str2, e):
+    logging.error(u"error in filter %s: %r, %r, %s", functionname, str1,
+                  str2, e)
+    return False
+
+
+def get_checker(checkstyle, languagecode, errorhandler=filtererrorhandler):
+    """Returns a checker for the given project checkstyle and language."""
+    checkerclasses = [checks.projectcheckers.get(checkstyle,
+                                                 checks.StandardChecker),
+                      checks.StandardUnitChecker]
+    return checks.TeeChecker(checkerclasses=checkerclasses,
+                             excludefilters=['hassuggestion'],
+                             errorhandler=errorhandler,
+                             languagecode=languagecode)
+
+
+class CheckUnit(object):
+    """Minimal, picklable stand-in for a unit with the fields that the
+    quality checks look at."""
+
+    def __init__(self, unit):
+        self.id = unit.id
+        self.source_strings = list(unit.source.strings)
+        self.target_strings = list(unit.target.strings)
+        self.plural = unit.hasplural()
+        self.locations = unit.getlocations()
+        self.fuzzy = unit.isfuzzy()
+
+    @property
+    def source(self):
+        return multistring(self.source_strings)
+
+    @property
+    def target(self):
+        return multistring(self.target_strings)
+
+    def hasplural(self):
+        return self.plural
+
+    def getlocations(self):
+        return self.locations
+
+    def isfuzzy(self):
+        return self.fuzzy
+
+    def isreview(self):
+        return False
+
+    def get_cache_key(self, checkstyle, languagecode):
+        """Returns a key identifying the results of checking this unit's
+        strings with the given checker configuration."""
+        key = u"\0".join([checkstyle, languagecode, str(toolkit_build),
+                          str(self.plural)] + self.locations + [u""] +
+                         self.source_strings + [u""] + self.target_strings)
+        return "qualitychecks:" + md5_f(key.encode("utf-8")).hexdigest()
+
+
+def instrument_checker(checker, timings):
+    """Makes ``checker`` add the number of calls and the time spent in each
+    check to the ``timings`` dictionary, as ``{name: [calls, seconds]}``."""
+    for subchecker in checker.checkers:
+        def timed_run_test(test, unit, run_test=subchecker.run_test):
+            start = time.time()
+            try:
+                return run_test(test, unit)
+            finally:
+                timing = timings.setdefault(test.__name__, [0, 0.0])
+                timing[0] += 1
+                timing[1] += time.time() - start
+        subchecker.run_test = timed_run_test
+    return checker
+
+
+def merge_timings(timings, other):
+    for name, (calls, seconds) in other.iteritems():
+        timing = timings.setdefault(name, [0, 0.0])
+        timing[0] += calls
+        timing[1] += seconds
+
+
+def record_timings(checkstyle, timings, pootle_path=None):
+    """Adds ``timings`` to the totals kept in the cache for ``checkstyle``
+    and, if given, for the store at ``pootle_path``."""
+    timeout = settings.OBJECT_CACHE_TIMEOUT
+
+    totals = cache.get(TIMINGS_KEY) or {}
+    merge_timings(totals.setdefault(checkstyle, {}), timings)
+    cache.set(TIMINGS_KEY, totals, timeout)
+
+    if pootle_path is not None:
+        store_totals = cache.get(STORE_TIMINGS_KEY) or {}
+        merge_timings(store_totals.setdefault(pootle_path, {}), timings)
+        if len(store_totals) > MAX_STORE_TIMINGS:
+            slowest = sorted(store_totals.iteritems(),
+                             key=lambda item: _total_seconds(item[1]),
+                             reverse=True)
+            store_totals = dict(slowest[:MAX_STORE_TIMINGS])
+        cache.set(STORE_TIMINGS_KEY, store_totals, timeout)
+
+
+def _total_seconds(timings):
+    return sum(seconds for calls, seconds in timings.itervalues())
+
+
+def _sorted_timings(timings):
+    return sorted(timings.iteritems(), key=lambda item: item[1][1],
+                  reverse=True)
+
+
+def get_timings():
+    """Returns the recorded check timings, slowest first, as a list of
+    ``(checkstyle, name, calls, seconds)`` tuples."""
+    result = []
+    for checkstyle, timings in (cache.get(TIMINGS_KEY) or {}).iteritems():
+        for name, (calls, seconds) in timings.iteritems():
+            result.append((checkstyle, name, calls, seconds))
+    result.sort(key=lambda timing: timing[3], reverse=True)
+    return result
+
+
+def get_store_timings(limit=10):
+    """Returns the ``limit`` stores where checks took the longest, as a list
+    of ``(pootle_path, seconds, timings)`` tuples where ``timings`` is a
+    list of ``(name, [calls, seconds])`` pairs, slowest first."""
+    store_totals = (cache.get(STORE_TIMINGS_KEY) or {}).items()
+    store_totals.sort(key=lambda item: _total_seconds(item[1]), reverse=True)
+    return [(pootle_path, _total_seconds(timings), _sorted_timings(timings))
+            for pootle_path, timings in store_totals[:limit]]
+
+
+def reset_timings():
+    cache.delete_many([TIMINGS_KEY, STORE_TIMINGS_KEY])
+
+
+def run_checks(checker, unit):
+    """Runs ``checker`` on ``unit`` and returns the failing checks as a list
+    of ``(name, message, category)`` tuples."""
+    qc_failures = checker.run_filters(unit, categorised=True)
+    return [(name, unicode(failure['message']), failure['category'])
+            for name, failure in qc_failures.iteritems()
+            if name != 'isfuzzy']
+
+
+# Checker used by each worker process, set up once by _init_worker, and the
+# timings it records for the unit being checked if profiling is enabled
+_worker_checker = None
+_worker_timings = {}
+
+
+def _init_worker(checkstyle, languagecode, profile):
+    global _worker_checker
+    _worker_checker = get_checker(checkstyle, languagecode)
+    if profile:
+        instrument_checker(_worker_checker, _worker_timings)
+
+
+def _run_worker(checkunit):
+    _worker_timings.clear()
+    failures = run_checks(_worker_checker, checkunit)
+    return checkunit.id, failures, dict(_worker_timings)
+
+
+class QualityCheckRunner(object):
+    """Runs the quality checks of one checkstyle and language on batches of
+    units.
+
+    If ``processes`` (which defaults to the ``QUALITYCHECK_PROCESSES``
+    setting) is greater than one, large batches are split among a pool of
+    worker processes that is started on first use and kept until
+    :meth:`close` is called, so a single runner can be reused for all the
+    stores of a translation project.
+
+    Results are memoized in the cache returned by :func:`get_results_cache`,
+    keyed by the unit strings and the checker configuration, so identical
+    units in other stores and projects are only checked once. Pass
+    ``use_cache=False`` to always run the checks.
+
+    If the ``QUALITYCHECK_PROFILING`` setting is enabled, the number of calls
+    and time spent in each check are recorded with :func:`record_timings`.
+    """
+
+    def __init__(self, checkstyle, languagecode, processes=None,
+                 use_cache=True):
+        self.checkstyle = checkstyle
+        self.languagecode = languagecode
+        if processes is None:
+            processes = getattr(settings, 'QUALITYCHECK_PROCESSES', 1)
+        self.processes = processes
+        self.use_cache = use_cache
+        self.profile = getattr(settings, 'QUALITYCHECK_PROFILING', False)
+        self.timings = {}
+        self._checker = None
+        self._pool = None
+
+    @property
+    def checker(self):
+        if self._checker is None:
+            self._checker = get_checker(self.checkstyle, self.languagecode)
+            if self.profile:
+                instrument_checker(self._checker, self.timings)
+        return self._checker
+
+    def _get_pool(self):
+        if self._pool is None:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(
+                    self.processes, _init_worker,
+                    (self.checkstyle, self.languagecode, self.profile))
+        return self._pool
+
+    def _run(self, checkunits):
+        if self.processes > 1 and len(checkunits) >= MIN_POOL_BATCH:
+            return self._run_pool(checkunits)
+
+        checker = self.checker
+        return ((checkunit.id, run_checks(checker, checkunit))
+                for checkunit in checkunits)
+
+    def _run_pool(self, checkunits):
+        for unit_id, failures, timings in self._get_pool().imap(
+                _run_worker, checkunits, POOL_CHUNKSIZE):
+            merge_timings(self.timings, timings)
+            yield unit_id, failures
+
+    def run(self, units, pootle_path=None):
+        """Runs the checks on the translated units in ``units``.
+
+        :param pootle_path: Path of the store the units belong to, used to
+            record per store timings when profiling.
+        :return: a list of ``(unit_id, failures)`` pairs, where ``failures``
+            is a list of ``(name, message, category)`` tuples.
+        """
+        checkunits = [CheckUnit(unit) for unit in units if unit.target]
+
+        if self.use_cache:
+            results = list(self._run_cached(checkunits))
+        else:
+            results = list(self._run(checkunits))
+
+        if self.timings:
+            record_timings(self.checkstyle, self.timings, pootle_path)
+            self.timings.clear()
+
+        return results
+
+    def _run_cached(self, checkunits):
+        results_cache = get_results_cache()
+        timeout = settings.OBJECT_CACHE_TIMEOUT
+
+        keys = dict((checkunit.id, checkunit.get_cache_key(self.checkstyle,
+                                                           self.languagecode))
+                    for checkunit in checkunits)
+        unique_keys = list(set(keys.itervalues()))
+        results = {}
+        for i in xrange(0, len(unique_keys), CACHE_BATCH):
+            results.update(results_cache.get_many(unique_keys[i:i+CACHE_BATCH]))
+
+        misses = []
+        seen = set()
+        for checkunit in checkunits:
+            key = keys[checkunit.id]
+            if key not in results and key not in seen:
+                seen.add(key)
+                misses.append(checkunit)
+
+        logging.debug(u"%d of %d quality check results cached",
+                      len(checkunits) - len(misses), len(checkunits))
+
+        new_results = {}
+        for unit_id, failures in self._run(misses):
+            new_results[keys[unit_id]] = failures
+            if len(new_results) >= CACHE_BATCH:
+                results_cache.set_many(new_results, timeout)
+                results.update(new_results)
+                new_results = {}
+        results_cache.set_many(new_results, timeout)
+        results.update(new_results)
+
+        return ((checkunit.id, results[keys[checkunit.id]])
+                for checkunit in checkunits)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def get_stale_stores(queryset):
+    """Filters the stores in ``queryset`` that have quality checks from an
+    older checker version."""
+    from pootle_store.models import CHECKED
+    return queryset.filter(state__gte=CHECKED,
+                           checker_version__lt=CHECKER_VERSION)
+
+
+def upgrade_qualitychecks():
+    """Re-runs the quality checks of all the stores checked with an older
+    checker version, one translation project at a time.
+
+    Old results are kept and served until each store is done.
+    """
+    from pootle_store.models import Store
+    from pootle_translationproject.models import TranslationProject
+
+    stale_stores = get_stale_stores(Store.objects.all())
+    tp_ids = list(stale_stores.values_list('translation_project', flat=True)
+                              .distinct())
+    for translation_project in TranslationProject.objects \
+                                                 .filter(id__in=tp_ids) \
+                                                 .iterator():
+        # Keep the lock alive while there is work left
+        cache.set(UPGRADE_LOCK_KEY, True, UPGRADE_LOCK_TIMEOUT)
+        translation_project.upgrade_qualitychecks()
+
+
+def _upgrade_worker():
+    from django.db import connection
+
+    try:
+        upgrade_qualitychecks()
+    except Exception, e:
+        logging.error(u"Failed to upgrade quality checks:\n%s", e)
+    finally:
+        cache.delete(UPGRADE_LOCK_KEY)
+        connection.close()
+
+
+def start_upgrade_worker():
+    """Starts upgrading stale quality checks in a background thread, unless
+    a worker is already running in any server process.
+
+    :return: ``True`` if a new worker was started.
+    """
+    if not cache.add(UPGRADE_LOCK_KEY, True, UPGRADE_LOCK_TIMEOUT):
+        return False
+
+    logging.info(u"Starting quality checks upgrade")
+    worker = threading.Thread(target=_upgrade_worker,
+                              name="qualitychecks-upgrade")
+    worker.setDaemon(True)
+    worker.start()
+    return True
@@ -19,13 +19,15 @@
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
 import time
 
+from django.conf import settings
 from django.utils import simplejson
 
 from translate.storage import factory
 from translate.storage import statsdb
 
 from pootle.tests import PootleTestCase
-from pootle_store.models import Store, Unit
+from pootle_store import qualitychecks
+from pootle_store.models import QualityCheck, Store, Unit
 
 class UnitTests(PootleTestCase):
     def setUp(self):
@@ -146,6 +148,29 @@ class SuggestionTests(PootleTestCase):
         suggestion.target = "gras++"
         assert first_hash != second_hash != suggestion.target_hash
 
+    def test_add_duplicate(self):
+        unit = self.store.getitem(0)
+        self.assertNotEqual(unit.add_suggestion(u"gras"), None)
+        self.assertEqual(unit.add_suggestion(u"gras"), None)
+        self.assertEqual(unit.get_suggestions().count(), 1)
+
+    def test_add_suggestions_bulk(self):
+        unit0 = self.store.getitem(0)
+        unit1 = self.store.getitem(1)
+        unit0.add_suggestion(u"gras")
+
+        added, duplicates = self.store.add_suggestions([
+            (unit0, u"gras", None),
+            (unit0, u"grass", None),
+            (unit1, u"gras", None),
+            (unit1, u"gras", None),
+            (unit1, u"", None),
+        ])
+        self.assertEqual(len(added), 2)
+        self.assertEqual(len(duplicates), 2)
+        self.assertEqual(unit0.get_suggestions().count(), 2)
+        self.assertEqual(unit1.get_suggestions().count(), 1)
+
 
 class StoreTests(PootleTestCase):
     def setUp(self):
@@ -167,6 +192,682 @@ class StoreTests(PootleTestCase):
         self.assertEqual(dbstats['translatedsourcewords'], filestats['translatedsourcewords'])
         self.assertEqual(dbstats['translatedtargetwords'], filestats['translatedtargetwords'])
 
+    def _get_qualitychecks(self):
+        return set(QualityCheck.objects.filter(unit__store=self.store)
+                                       .values_list('unit', 'name'))
+
+    def _add_failing_translations(self):
+        for item in (0, 1):
+            unit = self.store.getitem(item)
+            unit.target = u"%s  %s!!" % (unit.source, unit.source)
+            unit.save()
+
+    def test_update_qualitychecks(self):
+        self._add_failing_translations()
+        for unit in self.store.units.iterator():
+            unit.update_qualitychecks()
+        expected = self._get_qualitychecks()
+        self.assertTrue(expected)
+
+        self.store.update_qualitychecks()
+        self.assertEqual(self._get_qualitychecks(), expected)
+
+        # Force the use of worker processes even for this small store
+        min_pool_batch = qualitychecks.MIN_POOL_BATCH
+        qualitychecks.MIN_POOL_BATCH = 0
+        runner = self.store.translation_project.get_qualitycheck_runner(2)
+        try:
+            self.store.update_qualitychecks(runner=runner)
+        finally:
+            runner.close()
+            qualitychecks.MIN_POOL_BATCH = min_pool_batch
+        self.assertEqual(self._get_qualitychecks(), expected)
+
+    def test_update_qualitychecks_diff(self):
+        self._add_failing_translations()
+        self.store.update_qualitychecks()
+        checks = QualityCheck.objects.filter(unit__store=self.store)
+        check_ids = set(checks.values_list('id', flat=True))
+        self.assertTrue(check_ids)
+
+        # Unchanged failures keep their rows
+        self.store.update_qualitychecks()
+        self.assertEqual(set(checks.values_list('id', flat=True)), check_ids)
+
+        unit = self.store.getitem(0)
+        unit.update_qualitychecks()
+        self.assertEqual(set(checks.values_list('id', flat=True)), check_ids)
+
+        # Removed translations lose their checks
+        unit.target = u""
+        unit.save()
+        unit.update_qualitychecks()
+        self.assertFalse(unit.qualitycheck_set.exists())
+
+    def test_failing_checks_mask(self):
+        from pootle_misc.checks import get_check_mask
+        from pootle_store.views import get_step_query
+
+        self._add_failing_translations()
+        self.store.update_qualitychecks()
+        for unit in self.store.units.iterator():
+            names = unit.get_qualitychecks().values_list('name', flat=True)
+            self.assertEqual(unit.failing_checks, get_check_mask(names))
+
+        class FakeRequest(object):
+            pass
+        request = FakeRequest()
+        checks = QualityCheck.objects.filter(unit__store=self.store)
+        for name in set(checks.values_list('name', flat=True)):
+            request.GET = {'checks': name}
+            expected = set(checks.filter(name=name)
+                                 .values_list('unit', flat=True))
+            units = get_step_query(request, self.store.units)
+            self.assertEqual(set(units.values_list('id', flat=True)),
+                             expected)
+
+        check = checks[0]
+        check.false_positive = True
+        check.save()
+        check.unit.refresh_failing_checks()
+        check.unit.save()
+        request.GET = {'checks': check.name}
+        units = get_step_query(request, self.store.units)
+        self.assertFalse(units.filter(id=check.unit.id).exists())
+
+    def test_upgrade_qualitychecks(self):
+        self._add_failing_translations()
+        self.store.update_qualitychecks()
+        false_positive = QualityCheck.objects.filter(unit__store=self.store)[0]
+        false_positive.false_positive = True
+        false_positive.save()
+        expected = self._get_qualitychecks()
+
+        Store.objects.filter(id=self.store.id).update(checker_version=0)
+        translation_project = self.store.translation_project
+        stale_stores = qualitychecks.get_stale_stores(
+                translation_project.stores.all())
+        self.assertTrue(stale_stores.filter(id=self.store.id).exists())
+
+        translation_project.upgrade_qualitychecks()
+        self.assertFalse(stale_stores.filter(id=self.store.id).exists())
+        self.assertEqual(self._get_qualitychecks(), expected)
+        self.assertTrue(QualityCheck.objects.get(id=false_positive.id)
+                                            .false_positive)
+
+    def test_qualitycheck_profiling(self):
+        self._add_failing_translations()
+        qualitychecks.reset_timings()
+        project = self.store.translation_project.project
+        runner = qualitychecks.QualityCheckRunner(project.checkstyle, "af",
+                                                  use_cache=False)
+        runner.profile = True
+        runner.run(self.store.units, self.store.pootle_path)
+
+        timings = qualitychecks.get_timings()
+        self.assertTrue(timings)
+        self.assertEqual(timings[0][0], project.checkstyle)
+        store_timings = qualitychecks.get_store_timings()
+        self.assertEqual(store_timings[0][0], self.store.pootle_path)
+
+    def test_qualitycheck_results_cache(self):
+        translation_project = self.store.translation_project
+        self._add_failing_translations()
+        runner = translation_project.get_qualitycheck_runner()
+        results = dict(runner.run(self.store.units))
+        self.assertTrue(filter(None, results.values()))
+
+        results_cache = qualitychecks.get_results_cache()
+        for unit in self.store.units.filter(id__in=results.keys()):
+            key = qualitychecks.CheckUnit(unit).get_cache_key(
+                    translation_project.project.checkstyle,
+                    translation_project.language.code)
+            self.assertEqual(results_cache.get(key), results[unit.id])
+
+    def test_view_units_pages(self):
+        from pootle_store.util import get_units_generation
+
+        units = list(self.store.units)
+        untranslated = [unit.id for unit in units if not unit.istranslated()]
+        self.assertEqual(len(untranslated), 2)
+        # Anonymous responses are cached by the middleware
+        self.client.login(username="nonpriv", password="nonpriv")
+
+        def get_page(query):
+            query['pager'] = 1
+            r = self.client.get("%s/view/limit/1" % self.store.pootle_path,
+                                query, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            json = simplejson.loads(r.content)
+            self.links = [(unit.get('prev'), unit.get('next'))
+                          for unit in json['units']]
+            return ([unit['id'] for unit in json['units']],
+                    json['pager']['number'], json['pager']['num_pages'])
+
+        self.assertEqual(get_page({'page': 2}), ([units[1].id], 2, 3))
+        # Pages are linked to the units around them
+        self.assertEqual(self.links, [(units[0].id, units[2].id)])
+        self.assertEqual(get_page({'uid': units[2].id}), ([units[2].id], 3, 3))
+        self.assertEqual(get_page({'unitstates': 'untranslated', 'page': 2}),
+                         ([untranslated[1]], 2, 2))
+        self.assertEqual(self.links, [(untranslated[0], None)])
+
+        # Changing a unit invalidates the cached pages
+        unit = self.store.units.get(id=untranslated[0])
+        unit.target = u"samaka"
+        unit.save()
+        self.assertEqual(get_page({'unitstates': 'untranslated', 'page': 2}),
+                         ([untranslated[1]], 1, 1))
+
+        # Editing a translation without changing its state keeps them
+        generation = get_units_generation(self.store.translation_project_id)
+        unit = self.store.units.get(id=units[1].id)
+        unit.target = u"vis"
+        unit.save()
+        self.assertEqual(get_units_generation(self.store.translation_project_id),
+                         generation)
+
+    def test_generation_expiry(self):
+        from django.core.cache import cache
+        from pootle_misc.util import get_generation, update_generation
+
+        first = get_generation("test_generation")
+        update_generation("test_generation")
+        second = get_generation("test_generation")
+        self.assertNotEqual(second, first)
+
+        # A counter back from the cache never repeats an older value
+        time.sleep(0.01)
+        cache.delete("test_generation")
+        self.assertTrue(get_generation("test_generation") > second)
+
+    def test_cached_ids_chunks(self):
+        from array import array
+        from django.core.cache import cache
+        from pootle_store import views
+
+        dbids = array('i', range(10))
+        old_chunk = views.CACHED_IDS_CHUNK
+        views.CACHED_IDS_CHUNK = 4
+        try:
+            views._set_cached_ids("test_ids", dbids)
+            self.assertEqual(views._get_cached_ids("test_ids"), dbids)
+            # A missing chunk loses all of them
+            cache.delete("test_ids:1")
+            self.assertEqual(views._get_cached_ids("test_ids"), None)
+            views._set_cached_ids("test_ids", dbids[:3])
+            self.assertEqual(views._get_cached_ids("test_ids"), dbids[:3])
+        finally:
+            views.CACHED_IDS_CHUNK = old_chunk
+
+    def test_conditional_get(self):
+        from pootle_profile.models import PootleProfile
+
+        unit = self.store.units[0]
+        # Anonymous responses are cached by the middleware
+        self.client.login(username="nonpriv", password="nonpriv")
+
+        urls = ["%s/view" % self.store.pootle_path,
+                "%s/checks" % self.store.pootle_path,
+                "/unit/context/%s" % unit.id,
+                "/unit/timeline/%s" % unit.id]
+        # Quality checks are calculated on the first request
+        self.client.get(urls[1], HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        etags = {}
+        for url in urls:
+            r = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(r.status_code, 200)
+            etags[url] = r['ETag']
+            r = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(r.status_code, 304)
+
+        # Other parameters and changed units get a full response
+        r = self.client.get(urls[0], {'page': 2},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                            HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertEqual(r.status_code, 200)
+        profile = PootleProfile.objects.get(user__username="nonpriv")
+        profile.unit_rows = profile.get_unit_rows() + 1
+        profile.save()
+        r = self.client.get(urls[0], HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                            HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertEqual(r.status_code, 200)
+        unit.target = u"samaka"
+        unit.save()
+        for url in urls:
+            r = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(r.status_code, 200)
+
+    def test_timeline(self):
+        from datetime import datetime, timedelta
+        from pootle_statistics.models import Submission, SubmissionFields
+        from pootle_store.util import TRANSLATED, UNTRANSLATED
+        from pootle_store.views import _get_timeline
+
+        unit = self.store.units[0]
+        translation_project = self.store.translation_project
+        creation_time = datetime(2012, 1, 1)
+
+        def submit(creation_time, field, old_value, new_value):
+            Submission.objects.create(creation_time=creation_time,
+                                      translation_project=translation_project,
+                                      unit=unit, field=field,
+                                      old_value=old_value,
+                                      new_value=new_value)
+
+        submit(creation_time, SubmissionFields.TARGET, u"", u"samaki")
+        submit(creation_time, SubmissionFields.STATE, UNTRANSLATED,
+               TRANSLATED)
+        self.assertEqual(_get_timeline(unit),
+                         [(creation_time, None,
+                           [(SubmissionFields.TARGET, None, u"samaki"),
+                            (SubmissionFields.STATE, UNTRANSLATED,
+                             TRANSLATED)])])
+
+        # Later submissions are appended to the cached timeline
+        later = creation_time + timedelta(days=1)
+        submit(later, SubmissionFields.COMMENT, u"", u"Tasty")
+        groups = _get_timeline(unit)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(groups[1],
+                         (later, None,
+                          [(SubmissionFields.COMMENT, None, u"Tasty")]))
+
+        r = self.client.get("/unit/timeline/%s" % unit.id,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        timeline = simplejson.loads(r.content)['timeline']
+        self.assertTrue(timeline.index(u"Tasty") < timeline.index(u"samaki"))
+
+    def test_json_response(self):
+        from pootle_misc.util import (JSON_CHUNK_SIZE, iterjsonify, jsonify,
+                                      json_response)
+
+        json = {'units': [{'id': i, 'source': [{'text': u"fish %d" % i}]}
+                          for i in range(2 * JSON_CHUNK_SIZE / 10)]}
+        chunks = list(iterjsonify(json))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual("".join(chunks), jsonify(json))
+        self.assertEqual("".join(json_response(json)), jsonify(json))
+
+    def test_failing_checks_cache(self):
+        from django.core.cache import cache
+        from pootle_misc.checks import (get_quality_check_failures,
+                                        get_quality_check_failures_json)
+        from pootle_misc.stats import get_raw_stats
+
+        key = self.store.pootle_path + ":get_quality_check_failures"
+        failures = get_quality_check_failures_json(self.store)
+        self.assertEqual(simplejson.loads(failures),
+                         get_quality_check_failures(self.store,
+                                                    get_raw_stats(self.store),
+                                                    include_url=False))
+        self.assertEqual(cache.get(key).values(), [failures])
+
+        r = self.client.get("%s/checks" % self.store.pootle_path,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(r.content, failures)
+
+        # Cached failures go along with the complete stats
+        unit = self.store.units[0]
+        unit.target = u"samaka"
+        unit.save()
+        self.assertEqual(cache.get(key), None)
+
+    def test_sugg_lists_in_bulk(self):
+        from pootle_store.util import get_sugg_lists_in_bulk
+
+        units = list(self.store.units)
+        suggestions = [units[0].add_suggestion(u"samaki"),
+                       units[0].add_suggestion(u"samaka"),
+                       units[1].add_suggestion(u"resto")]
+        units = list(Unit.objects.filter(id__in=[unit.id for unit in units])
+                                 .select_related('store__translation_project__project'))
+
+        # Suggestions and their units need no further queries
+        def get_sugg_lists():
+            sugg_lists = get_sugg_lists_in_bulk(units)
+            for sugg_list in sugg_lists.values():
+                for sugg, score in sugg_list:
+                    sugg.unit.target
+            return sugg_lists
+        self.assertNumQueries(1, get_sugg_lists)
+        self.assertEqual(get_sugg_lists_in_bulk(units),
+                         {units[0].id: [(suggestions[0], False),
+                                        (suggestions[1], False)],
+                          units[1].id: [(suggestions[2], False)],
+                          units[2].id: []})
+
+    def test_context_units(self):
+        from django.db import connection
+        from pootle_store.views import _filter_ctx_units
+
+        units = list(self.store.units)
+
+        def get_ids(ctx):
+            return ([unit['id'] for unit in ctx['before']],
+                    [unit['id'] for unit in ctx['after']])
+
+        # Both sides of the context are read with one query
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            ctx = _filter_ctx_units(self.store.units, units[1], 1)
+            queries = connection.queries[start:]
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual(len([query for query in queries
+                              if Unit._meta.db_table in query['sql']]), 1)
+        self.assertEqual(get_ids(ctx), ([units[0].id], [units[2].id]))
+        ctx = _filter_ctx_units(self.store.units, units[0], 1, gap=1)
+        self.assertEqual(get_ids(ctx), ([], [units[2].id]))
+        self.assertEqual(_filter_ctx_units(self.store.units, units[1], 0),
+                         {'before': [], 'after': []})
+
+        # Units left out of the queryset don't shorten the context
+        ctx = _filter_ctx_units(self.store.units.exclude(id=units[1].id),
+                                units[2], 2)
+        self.assertEqual(get_ids(ctx), ([units[0].id], []))
+
+    def test_altsrcs_in_bulk(self):
+        from pootle_store.util import find_altsrcs_in_bulk
+
+        units = list(self.store.units)
+        project = self.store.translation_project.project
+        language = self.store.translation_project.language
+        self.assertNumQueries(1, find_altsrcs_in_bulk, units, [language],
+                              project)
+        # Only translated units are alternative sources
+        self.assertEqual(find_altsrcs_in_bulk(units, [language], project),
+                         {units[0].id: [], units[1].id: [units[1]],
+                          units[2].id: []})
+        self.assertEqual(find_altsrcs_in_bulk(units, [], project),
+                         {units[0].id: [], units[1].id: [], units[2].id: []})
+
+    def test_alt_src_langs(self):
+        from django.contrib.auth.models import User
+        from django.http import HttpRequest
+        from pootle_language.models import Language
+        from pootle_store.views import get_alt_src_langs
+
+        profile = User.objects.get(username="nonpriv").get_profile()
+        translation_project = self.store.translation_project
+        request = HttpRequest()
+        self.assertEqual(get_alt_src_langs(request, profile,
+                                           translation_project), [])
+
+        # Cached languages follow the changes of the profile
+        arabic = Language.objects.get(code="ar")
+        profile.alt_src_langs.add(arabic)
+        self.assertEqual(get_alt_src_langs(request, profile,
+                                           translation_project), [arabic])
+        arabic.user_alt_src_langs.clear()
+        self.assertEqual(get_alt_src_langs(request, profile,
+                                           translation_project), [])
+
+        # And those of the translation projects of the project
+        japanese = Language.objects.get(code="ja")
+        profile.alt_src_langs.add(japanese)
+        self.assertEqual(get_alt_src_langs(request, profile,
+                                           translation_project), [japanese])
+        translation_project.project.translationproject_set \
+                                   .get(language=japanese).delete()
+        self.assertEqual(get_alt_src_langs(request, profile,
+                                           translation_project), [])
+
+
+class SearchTests(PootleTestCase):
+    def setUp(self):
+        super(SearchTests, self).setUp()
+        self.store = Store.objects.get(pootle_path="/af/tutorial/pootle.po")
+        self.translation_project = self.store.translation_project
+
+    def _make_form(self, search, sfields):
+        class FakeForm(object):
+            pass
+        form = FakeForm()
+        form.cleaned_data = {'search': search, 'sfields': sfields}
+        return form
+
+    def _search(self, search, sfields):
+        from pootle_store.views import (get_non_indexed_search_step_query,
+                                        get_search_results)
+
+        form = self._make_form(search, sfields)
+        non_indexed = set(get_non_indexed_search_step_query(form,
+                self.store.units).values_list('id', flat=True))
+        indexed = get_search_results(self.translation_project, form,
+                                     self.store.pootle_path)
+        if indexed is None:
+            return non_indexed, non_indexed
+        return set(indexed), non_indexed
+
+    def test_embedded_indexer(self):
+        from pootle_misc.indexer import SQLiteDatabase
+
+        self.assertTrue(isinstance(self.translation_project.indexer,
+                                   SQLiteDatabase))
+        for search, sfields in ((u"fish", ['source']),
+                                (u"REST", ['source', 'target']),
+                                (u"fis d", ['source']),
+                                (u"ishie", ['source']),
+                                (u"%d", ['source']),
+                                (u"h", ['source', 'target']),
+                                (u"st.", ['locations']),
+                                (u"nothing-like-this", ['source']),
+                                (u"test.c", ['locations'])):
+            indexed, non_indexed = self._search(search, sfields)
+            self.assertTrue(indexed or search == u"nothing-like-this")
+            self.assertEqual(indexed, non_indexed)
+
+    def test_embedded_indexer_update(self):
+        indexer = self.translation_project.indexer
+        unit = self.store.getitem(0)
+        unit.target = u"Unieke vertaling"
+        unit.save()
+        self.translation_project.update_index(indexer, self.store, unit.id)
+        self.assertEqual(self._search(u"unieke", ['target'])[0],
+                         set([unit.id]))
+
+        indexer.delete_doc({"pofilename": self.store.pootle_path})
+        self.assertEqual(self._search(u"fish", ['source'])[0], set())
+
+    def test_index_build(self):
+        from django.core.cache import cache
+
+        # Pretend another server process is building the index
+        lock_key = self.translation_project._get_index_build_key()
+        cache.set(lock_key, True)
+        settings.INDEX_BACKGROUND_BUILD = True
+        try:
+            self.assertFalse(self.translation_project.start_index_build())
+            self.assertEqual(self.translation_project.indexer, None)
+            self.assertTrue(self.translation_project.is_index_building)
+            indexed, non_indexed = self._search(u"fish", ['source'])
+            self.assertEqual(indexed, non_indexed)
+        finally:
+            settings.INDEX_BACKGROUND_BUILD = False
+            cache.delete(lock_key)
+
+        # Only asking for the indexer starts a build
+        settings.INDEX_BACKGROUND_BUILD = True
+        try:
+            self.assertEqual(self.translation_project.ready_indexer, None)
+            self.assertFalse(self.translation_project.is_index_building)
+        finally:
+            settings.INDEX_BACKGROUND_BUILD = False
+
+        self.assertTrue(self.translation_project.build_index() is not None)
+        self.assertTrue(self.translation_project.indexer is not None)
+
+    def test_index_queue(self):
+        from pootle_translationproject import indexqueue
+
+        self.assertTrue(self.translation_project.indexer is not None)
+        settings.INDEX_UPDATE_DELAY = 60
+        try:
+            unit = self.store.getitem(0)
+            unit.target = u"Unieke vertaling"
+            unit.save()
+            self.assertEqual(self._search(u"unieke", ['target'])[0], set())
+        finally:
+            settings.INDEX_UPDATE_DELAY = 0
+
+        # The units are only queued once their transaction is over
+        indexqueue.flush()
+        self.assertEqual(self._search(u"unieke", ['target'])[0], set())
+        indexqueue.transaction_committed()
+        indexqueue.flush()
+        self.assertEqual(self._search(u"unieke", ['target'])[0],
+                         set([unit.id]))
+
+    def test_search_pagination(self):
+        expected = [unit.id for unit in
+                    self.store.units.filter(source_f__icontains=u"fish")]
+        self.assertEqual(len(expected), 2)
+
+        url = "%s/view/limit/1" % self.store.pootle_path
+        query = {'search': u"fish", 'sfields': 'source', 'pager': 1}
+        for page, uid in enumerate(expected):
+            query['page'] = page + 1
+            r = self.client.get(url, query,
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            json = simplejson.loads(r.content)
+            self.assertEqual([unit['id'] for unit in json['units']], [uid])
+            self.assertEqual(json['pager']['num_pages'], 2)
+
+        del query['page']
+        query['uid'] = expected[1]
+        r = self.client.get(url, query, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        json = simplejson.loads(r.content)
+        self.assertEqual(json['pager']['number'], 2)
+
+    def test_search_pagination_database(self):
+        from django.core.cache import cache
+
+        # Anonymous responses are cached by the middleware
+        self.client.login(username="nonpriv", password="nonpriv")
+        url = "%s/view" % self.store.pootle_path
+        query = {'search': u"zebra", 'sfields': 'target'}
+
+        def get_units():
+            r = self.client.get(url, query,
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            return [unit['id'] for unit in simplejson.loads(r.content)['units']]
+
+        self.translation_project.non_db_state.indexer = None
+        settings.INDEX_BACKGROUND_BUILD = True
+        cache_key = self.translation_project._get_index_build_key()
+        cache.set(cache_key, True)
+        try:
+            self.assertEqual(get_units(), [])
+            # Cached results follow the texts of the units
+            unit = self.store.units[1]
+            unit.target = u"zebra"
+            unit.save()
+            self.assertEqual(get_units(), [unit.id])
+        finally:
+            settings.INDEX_BACKGROUND_BUILD = False
+            cache.delete(cache_key)
+
+    def test_search_conditional_get(self):
+        # Anonymous responses are cached by the middleware
+        self.client.login(username="nonpriv", password="nonpriv")
+        url = "%s/view" % self.store.pootle_path
+        query = {'search': u"fish", 'sfields': 'source'}
+        # The index is built on the first request
+        self.client.get(url, query, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        r = self.client.get(url, query,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        etag = r['ETag']
+        r = self.client.get(url, query, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        # Updating the index changes the results of searches
+        self.translation_project._update_index_generation()
+        r = self.client.get(url, query, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_search_paths(self):
+        from django.db import connection
+        from pootle_store.views import get_search_results
+
+        form = self._make_form(u"fish", ['source'])
+        expected = list(self.store.units.filter(source_f__icontains=u"fish") \
+                                        .values_list('id', flat=True))
+        for pootle_path in (None, self.store.pootle_path,
+                            self.translation_project.pootle_path):
+            self.assertEqual(list(get_search_results(self.translation_project,
+                                                     form, pootle_path)),
+                             expected)
+        self.assertEqual(list(get_search_results(self.translation_project,
+                                                 form, u"/af/tutorial/nope/")),
+                         [])
+
+        # Cached results are found without querying units, the only queries
+        # left are those of the database cache backend
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            get_search_results(self.translation_project, form,
+                               self.store.pootle_path)
+            queries = connection.queries[start:]
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual([query for query in queries
+                          if Unit._meta.db_table in query['sql']], [])
+
+    def test_global_search(self):
+        from django.core.cache import cache
+
+        exact = self.store.units.get(source_f=u"fish")
+        query = {'search': u"fish", 'sfields': 'source'}
+        r = self.client.get("/search/", query,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        json = simplejson.loads(r.content)
+        # The exact match is ranked first
+        self.assertEqual(json['units'][0]['id'], exact.id)
+        self.assertEqual(json['units'][0]['language'], u"af")
+
+        # Projects without an index are searched in the database
+        self.translation_project.non_db_state.indexer = None
+        settings.INDEX_BACKGROUND_BUILD = True
+        cache_key = self.translation_project._get_index_build_key()
+        cache.set(cache_key, True)
+        try:
+            query.update({'language': u"af", 'search': u"FISH"})
+            r = self.client.get("/search/", query,
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            json = simplejson.loads(r.content)
+            self.assertEqual(set([unit['id'] for unit in json['units']]),
+                             set([unit.id for unit in
+                                  self.store.units.filter(source_f__icontains=u"fish")]))
+
+            # Their cached results follow the changes of the units.
+            # Anonymous responses are cached by the middleware
+            self.client.login(username="nonpriv", password="nonpriv")
+            target_query = {'language': u"af", 'search': u"zebra",
+                            'sfields': 'target'}
+            r = self.client.get("/search/", target_query,
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(simplejson.loads(r.content)['units'], [])
+            exact.target = u"zebra"
+            exact.save()
+            r = self.client.get("/search/", target_query,
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual([unit['id'] for unit in
+                              simplejson.loads(r.content)['units']],
+                             [exact.id])
+        finally:
+            settings.INDEX_BACKGROUND_BUILD = False
+            cache.delete(cache_key)
+
+        r = self.client.get("/search/", {'search': u""},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(r.status_code, 400)
+
 
 class XHRTestAnonymous(PootleTestCase):
     """
@@ -255,6 +956,30 @@ class XHRTestAnonymous(PootleTestCase):
         self.assertEqual(r.status_code, 200)
         self.assertTemplateUsed(r, 'unit/edit.html')
 
+    def test_get_edit_unit_next(self):
+        """Checks the editing widgets sent ahead for the next units."""
+        units = list(self.store.units)
+        r = self.client.get("/unit/edit/%s" % self.uid,
+                            {'next': "%s,%s,%s" % (units[1].id, units[2].id,
+                                                   self.bad_uid)},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(r.status_code, 200)
+        json = simplejson.loads(r.content)
+        self.assertEqual(sorted(json['next'].keys()),
+                         sorted([str(units[1].id), str(units[2].id)]))
+
+        r = self.client.get("/unit/edit/%s" % units[1].id,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(json['next'][str(units[1].id)]['editor'],
+                         simplejson.loads(r.content)['editor'])
+
+        # Cached widgets follow the changes of their unit
+        units[1].target = u"arraina"
+        units[1].save()
+        r = self.client.get("/unit/edit/%s" % units[1].id,
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(u"arraina" in simplejson.loads(r.content)['editor'])
+
     #
     # Tests for the get_failing_checks() view.
     #
@@ -29,6 +29,7 @@ urlpatterns = patterns('pootle_store.views',
     (r'^(?P<pootle_path>.*)/checks/?$', 'get_failing_checks_store'),
     (r'^(?P<pootle_path>.*)/view/?$', 'get_view_units_store'),
     (r'^(?P<pootle_path>.*)/view/limit/(?P<limit>[0-9]+)/?$', 'get_view_units_store'),
+    (r'^search/?$', 'search'),
     (r'^unit/context/(?P<uid>[0-9]+)/?$', 'get_more_context'),
     (r'^unit/edit/(?P<uid>[0-9]+)/?$', 'get_edit_unit'),
     (r'^unit/submit/(?P<uid>[0-9]+)/?$', 'submit'),
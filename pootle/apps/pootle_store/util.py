@@ -26,7 +26,7 @@ from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 
 from pootle_misc.aggregate import sum_column
-from pootle_misc.util import dictsum
+from pootle_misc.util import dictsum, get_generation, update_generation
 
 
 # Unit States
@@ -47,6 +47,45 @@ STATES_MAP = {
     TRANSLATED: _("Translated"),
 }
 
+class UnitIdList(object):
+    """Sequence of the units with ids ``ids`` in ``queryset``, in the order
+    of ``ids``.
+
+    Units are only fetched when sliced, so the list can be paginated
+    without loading all of them.
+    """
+
+    def __init__(self, ids, queryset):
+        self.ids = ids
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            ids = list(self.ids[key])
+            units = self.queryset.in_bulk(ids)
+            return [units[id] for id in ids if id in units]
+        return self.queryset.get(id=self.ids[key])
+
+
+def _get_units_generation_key(translation_project_id):
+    return "units_generation:%d" % translation_project_id
+
+
+def get_units_generation(translation_project_id):
+    """Returns a counter that changes whenever units of the translation
+    project with id ``translation_project_id`` are added, moved or removed,
+    or change their state, failing checks or suggestions, to be used in the
+    cache keys of unit lists."""
+    return get_generation(_get_units_generation_key(translation_project_id))
+
+
+def update_units_generation(translation_project_id):
+    update_generation(_get_units_generation_key(translation_project_id))
+
+
 def add_trailing_slash(path):
     """If path does not end with /, add it and return."""
 
@@ -153,13 +192,27 @@ def suggestions_sum(queryset):
 
 
 def find_altsrcs(unit, alt_src_langs, store=None, project=None):
-    from pootle_store.models import Unit
-
     store = store or unit.store
     project = project or store.translation_project.project
+    return find_altsrcs_in_bulk([unit], alt_src_langs, project)[unit.id]
+
+
+def find_altsrcs_in_bulk(units, alt_src_langs, project):
+    """Looks up the translations of ``units``, which belong to ``project``,
+    into the alternative source languages ``alt_src_langs`` with a single
+    query by ``unitid_hash``.
 
-    altsrcs = Unit.objects.filter(
-                    unitid_hash=unit.unitid_hash,
+    :return: A dictionary of lists of :cls:`Unit`, keyed by unit id.
+    """
+    from pootle_store.models import Unit
+
+    altsrcs = dict([(unit.id, []) for unit in units])
+    if not units or not alt_src_langs:
+        return altsrcs
+
+    nongnu = project.get_treestyle() == 'nongnu'
+    candidates = Unit.objects.filter(
+                    unitid_hash__in=set([unit.unitid_hash for unit in units]),
                     store__translation_project__project=project,
                     store__translation_project__language__in=alt_src_langs,
                     state=TRANSLATED) \
@@ -167,9 +220,22 @@ def find_altsrcs(unit, alt_src_langs, store=None, project=None):
                                 'store', 'store__translation_project',
                                 'store__translation_project__language')
 
-    if project.get_treestyle() == 'nongnu':
-        altsrcs = altsrcs.filter(store__name=store.name)
-
+    if nongnu:
+        candidates = candidates.filter(
+                store__name__in=set([unit.store.name for unit in units]))
+
+    found = {}
+    for candidate in candidates:
+        key = candidate.unitid_hash
+        if nongnu:
+            key = (key, candidate.store.name)
+        found.setdefault(key, []).append(candidate)
+
+    for unit in units:
+        key = unit.unitid_hash
+        if nongnu:
+            key = (key, unit.store.name)
+        altsrcs[unit.id] = found.get(key, [])
     return altsrcs
 
 
@@ -180,18 +246,45 @@ def get_sugg_list(unit):
              it in case it's a terminology project. Otherwise the score
              part is filled with False values.
     """
-    sugg_list = []
-    scores = {}
-    suggestions = unit.get_suggestions()
+    return get_sugg_lists_in_bulk([unit])[unit.id]
+
+
+def get_sugg_lists_in_bulk(units):
+    """Gets the suggestion lists of ``units``, as :func:`get_sugg_list`
+    does for a single unit.
 
+    Suggestions and their authors are read with a single query, and the
+    scores of those made in terminology stores with another one.
+
+    :return: A dictionary of suggestion lists keyed by unit id.
+    """
+    from pootle_store.models import Suggestion
+
+    sugg_lists = dict([(unit.id, []) for unit in units])
+    if not units:
+        return sugg_lists
+
+    units_by_id = dict([(unit.id, unit) for unit in units])
+    suggestions = list(Suggestion.objects.filter(unit__in=units_by_id.keys())
+                                         .select_related('user__user')
+                                         .order_by('id'))
+
+    terminology = []
+    for sugg in suggestions:
+        # Avoids a query per suggestion when their unit is used
+        sugg.unit = units_by_id[sugg.unit_id]
+        if (sugg.unit.store.is_terminology or
+            sugg.unit.store.translation_project.project.is_terminology):
+            terminology.append(sugg)
+
+    scores = {}
     # Avoid the votes query if we're not editing terminology
-    if (suggestions and (unit.store.is_terminology or
-        unit.store.translation_project.project.is_terminology)):
+    if terminology:
         from voting.models import Vote
-        scores = Vote.objects.get_scores_in_bulk(suggestions)
+        scores = Vote.objects.get_scores_in_bulk(terminology)
 
     for sugg in suggestions:
         score = scores.get(sugg.id, False)
-        sugg_list.append((sugg, score))
+        sugg_lists[sugg.unit_id].append((sugg, score))
 
-    return sugg_list
+    return sugg_lists
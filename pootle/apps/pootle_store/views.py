@@ -20,33 +20,42 @@
 
 import os
 import logging
+import Queue
+import threading
+from array import array
 from datetime import datetime
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
+from django.db import connection
 from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import loader, RequestContext
-from django.utils.translation import to_locale, ugettext as _
+from django.utils.translation import get_language, to_locale, ugettext as _
 from django.utils.translation.trans_real import parse_accept_lang_header
 from django.utils import simplejson
 from django.utils.encoding import iri_to_uri
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 
 from translate.lang import data
+from translate.misc.hash import md5_f
 
 from pootle_app.models import Suggestion as SuggestionStat
 from pootle_app.models.permissions import (get_matching_permissions,
                                            check_permission,
                                            check_profile_permission)
-from pootle_misc.baseurl import redirect
-from pootle_misc.checks import get_quality_check_failures
+from pootle_misc.baseurl import l, redirect
+from pootle_misc.checks import (check_bits, get_check_mask,
+                                get_quality_check_failures_json)
 from pootle_misc.forms import make_search_form
-from pootle_misc.stats import get_raw_stats
+from pootle_misc.indexer import tokenize
 from pootle_misc.url_manip import ensure_uri, previous_view_url
-from pootle_misc.util import paginate, ajax_required, jsonify
-from pootle_profile.models import get_profile
+from pootle_misc.util import (paginate, ajax_required, jsonify,
+                              json_response, get_generations)
+from pootle_profile.models import (PootleProfile,
+                                   get_alt_src_langs_generation, get_profile)
 from pootle_statistics.models import (Submission, SubmissionFields,
                                       SubmissionTypes)
 from pootle_store.models import Store, Unit
@@ -56,8 +65,12 @@ from pootle_store.signals import translation_submitted
 from pootle_store.templatetags.store_tags import (highlight_diffs,
                                                   pluralize_source,
                                                   pluralize_target)
-from pootle_store.util import (UNTRANSLATED, FUZZY, TRANSLATED, STATES_MAP,
-                               absolute_real_path, find_altsrcs, get_sugg_list)
+from pootle_translationproject.models import (TranslationProject,
+                                               get_translation_projects_generation)
+from pootle_store.util import (OBSOLETE, UNTRANSLATED, FUZZY, TRANSLATED,
+                               STATES_MAP, UnitIdList,
+                               absolute_real_path, find_altsrcs_in_bulk,
+                               get_sugg_lists_in_bulk, get_units_generation)
 
 
 def _common_context(request, translation_project, permission_codes):
@@ -110,6 +123,49 @@ def get_unit_context(permission_codes):
     return wrap_f
 
 
+def _get_etag(request, *parts):
+    """Returns an ETag for a response of ``request`` that only depends on
+    ``parts``, the path and query string and the user and language of the
+    request."""
+    descriptor = (request.path, request.user.id, get_language(),
+                  sorted(request.GET.lists())) + parts
+    return md5_f(repr(descriptor)).hexdigest()
+
+
+def _get_store_etag(request, store, *args, **kwargs):
+    """Returns an ETag that changes whenever units of ``store`` change."""
+    return _get_etag(request, store.pootle_path, store.get_mtime(),
+                     get_units_generation(store.translation_project_id),
+                     args, kwargs)
+
+
+def _get_view_units_etag(request, store, limit=0):
+    """Returns an ETag for the unit pages of ``store``, which also depend on
+    the page size, that of the profile of the user unless ``limit`` is
+    given, and on the search index when searching."""
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = None
+    if not limit:
+        limit = request.profile.get_unit_rows()
+    search = None
+    if 'search' in request.GET and 'sfields' in request.GET:
+        # Indexed results change when the index is updated, after the units
+        search = (request.GET['search'], request.GET['sfields'],
+                  store.translation_project.get_index_generation())
+    return _get_store_etag(request, store, limit, search)
+
+
+def _get_unit_store_etag(request, unit, *args, **kwargs):
+    return _get_store_etag(request, unit.store, unit.id, *args, **kwargs)
+
+
+def _get_unit_etag(request, unit, *args, **kwargs):
+    """Returns an ETag that changes whenever ``unit`` changes."""
+    return _get_etag(request, unit.id, unit.mtime, args, kwargs)
+
+
 @get_store_context('view')
 def export_as_xliff(request, store):
     """Export given file to xliff for offline translation."""
@@ -180,6 +236,28 @@ def download(request, store):
 ####################### Translate Page ##############################
 
 def get_alt_src_langs(request, profile, translation_project):
+    """Returns the alternative source languages of ``profile`` in
+    ``translation_project``: those set in the profile or else the first
+    match of the Accept-Language header of ``request``.
+
+    The resolution is cached until the languages of the profile or the
+    translation projects of the project change.
+
+    :rtype: list of :cls:`Language`
+    """
+    accept = request.META.get('HTTP_ACCEPT_LANGUAGE', '')
+    descriptor = (profile.id, get_alt_src_langs_generation(profile.id),
+                  translation_project.id,
+                  get_translation_projects_generation(translation_project.project_id),
+                  accept)
+    cache_key = "alt_src_langs:%s" % str(hash(repr(descriptor)))
+    langs = cache.get(cache_key)
+    if langs is None:
+        langs = list(_get_alt_src_langs(request, profile, translation_project))
+        cache.set(cache_key, langs, settings.OBJECT_CACHE_TIMEOUT)
+    return langs
+
+def _get_alt_src_langs(request, profile, translation_project):
     language = translation_project.language
     project = translation_project.project
     source_language = project.source_language
@@ -203,6 +281,13 @@ def get_alt_src_langs(request, profile, translation_project):
     return langs
 
 def get_non_indexed_search_step_query(form, units_queryset):
+    """Narrows down ``units_queryset`` to the units matching the search in
+    ``form``, with ``icontains`` lookups on the database.
+
+    This is only used while the index of the translation project is not
+    ready, so the trigram index of the embedded engine can't be used to
+    narrow down the candidates.
+    """
     words = form.cleaned_data['search'].split()
     result = units_queryset.none()
 
@@ -235,47 +320,294 @@ def get_non_indexed_search_step_query(form, units_queryset):
     return result
 
 
-def get_search_step_query(translation_project, form, units_queryset):
-    """Narrows down units query to units matching search string."""
+#: Number of search results filtered in a single query
+SEARCH_BATCH = 500
+
+
+def _get_word_queries(indexer, words, fields):
+    """Returns a list of ``indexer`` queries, one for each of ``words``,
+    matching the units containing the word in any of ``fields``."""
+    searchparts = []
+    # The embedded indexer can find substrings, like the database search
+    substring_query = getattr(indexer, 'make_substring_query', None)
+    # Split the search expression into single words. Otherwise xapian and
+    # lucene would interprete the whole string as an "OR" combination of
+    # words instead of the desired "AND".
+    for word in words:
+        # Generate a list for the query based on the selected fields
+        if substring_query is not None:
+            word_querylist = [substring_query(field, word) for field in fields]
+        else:
+            word_querylist = [(field, word) for field in fields]
+        textquery = indexer.make_query(word_querylist, False)
+        searchparts.append(textquery)
+    return searchparts
+
+
+def get_search_cache_key(translation_project, pootle_path, words, fields,
+                          filters=()):
+    """Returns the cache key for the results of searching ``words`` in
+    ``fields`` of the units under ``pootle_path``, narrowed down by
+    ``filters``, a sequence of ``(name, value)`` pairs.
+
+    The key is computed without touching the database: it changes with the
+    index generation of ``translation_project``, which is increased whenever
+    its units are re-indexed.
+    """
+    descriptor = (pootle_path, tuple(words), tuple(fields), tuple(filters),
+                  translation_project.get_index_generation())
+    return "search:%s" % str(hash(repr(descriptor)))
+
+
+#: Number of ids cached in a single cache entry, to stay well within the
+#: item size limit of memcached
+CACHED_IDS_CHUNK = 131072
+
+
+def _get_cached_ids(cache_key):
+    cached = cache.get(cache_key)
+    if cached is None:
+        return None
+    dbids = array('i')
+    if isinstance(cached, (int, long)):
+        # The ids are split in ``cached`` chunks
+        chunk_keys = ["%s:%d" % (cache_key, i) for i in xrange(cached)]
+        chunks = cache.get_many(chunk_keys)
+        if len(chunks) < len(chunk_keys):
+            return None
+        for chunk_key in chunk_keys:
+            dbids.fromstring(chunks[chunk_key])
+    else:
+        dbids.fromstring(cached)
+    return dbids
 
-    if translation_project.indexer is None:
+
+def _set_cached_ids(cache_key, dbids):
+    if len(dbids) <= CACHED_IDS_CHUNK:
+        cache.set(cache_key, dbids.tostring(), settings.OBJECT_CACHE_TIMEOUT)
+        return
+
+    chunks = {}
+    for i, start in enumerate(xrange(0, len(dbids), CACHED_IDS_CHUNK)):
+        chunks["%s:%d" % (cache_key, i)] = \
+                dbids[start:start+CACHED_IDS_CHUNK].tostring()
+    cache.set_many(chunks, settings.OBJECT_CACHE_TIMEOUT)
+    cache.set(cache_key, len(chunks), settings.OBJECT_CACHE_TIMEOUT)
+
+
+def get_search_results(translation_project, form, pootle_path=None):
+    """Returns the ids of the units under ``pootle_path`` matching the search
+    in ``form``, in the order of the editor, or ``None`` if the translation
+    project has no indexer.
+
+    ``pootle_path`` is the path of a store or a directory of the translation
+    project, all of it if ``None``.
+
+    There is no limit on the number of results: the ids are read from the
+    indexer in batches and cached per query as a compact array.
+
+    :rtype: ``array.array`` of ints
+    """
+    indexer = translation_project.indexer
+    if indexer is None:
         logging.debug(u"No indexer for %s, using database search", translation_project)
-        return get_non_indexed_search_step_query(form, units_queryset)
+        return None
 
     logging.debug(u"Found %s indexer for %s, using indexed search",
-                  translation_project.indexer.INDEX_DIRECTORY_NAME, translation_project)
+                  indexer.INDEX_DIRECTORY_NAME, translation_project)
 
-    word_querylist = []
+    if pootle_path is None:
+        pootle_path = translation_project.pootle_path
     words = form.cleaned_data['search'].split()
     fields = form.cleaned_data['sfields']
-    paths = units_queryset.order_by().values_list('store__pootle_path', flat=True).distinct()
-    path_querylist = [('pofilename', pootle_path) for pootle_path in paths.iterator()]
-    cache_key = "search:%s" % str(hash((repr(path_querylist), translation_project.get_mtime(), repr(words), repr(fields))))
-
-    dbids = cache.get(cache_key)
-    if dbids is None:
-        searchparts = []
-        # Split the search expression into single words. Otherwise xapian and
-        # lucene would interprete the whole string as an "OR" combination of
-        # words instead of the desired "AND".
-        for word in words:
-            # Generate a list for the query based on the selected fields
-            word_querylist = [(field, word) for field in fields]
-            textquery = translation_project.indexer.make_query(word_querylist, False)
-            searchparts.append(textquery)
+    cache_key = get_search_cache_key(translation_project, pootle_path, words,
+                                     fields)
+
+    dbids = _get_cached_ids(cache_key)
+    if dbids is not None:
+        return dbids
+
+    searchparts = _get_word_queries(indexer, words, fields)
+    if not pootle_path.endswith('/'):
+        searchparts.append(indexer.make_query([('pofilename', pootle_path)]))
+    elif (pootle_path != translation_project.pootle_path and
+          hasattr(indexer, 'iter_values')):
+        # All the stores in the directory
+        searchparts.append(indexer.make_query([('pofilename', pootle_path)],
+                                              analyzer=indexer.ANALYZER_PARTIAL))
+    limitedquery = indexer.make_query(searchparts, True)
+
+    if hasattr(indexer, 'iter_values'):
+        # Sorted by the indexer and read through a cursor
+        dbids = array('i', [int(dbid) for dbid in
+                            indexer.iter_values(limitedquery, 'dbid',
+                                                ['pofilename', 'itemno'])])
+    else:
+        result = indexer.search(limitedquery, ['dbid', 'pofilename', 'itemno'])
+        result = [item for item in result
+                  if item['pofilename'][0].startswith(pootle_path)]
+        result.sort(key=lambda item: (item['pofilename'][0],
+                                      int(item['itemno'][0])))
+        dbids = array('i', [int(item['dbid'][0]) for item in result])
+
+    _set_cached_ids(cache_key, dbids)
+    return dbids
 
-        pathquery = translation_project.indexer.make_query(path_querylist, False)
-        searchparts.append(pathquery)
-        limitedquery = translation_project.indexer.make_query(searchparts, True)
 
-        result = translation_project.indexer.search(limitedquery, ['dbid'])
-        dbids = [int(item['dbid'][0]) for item in result[:999]]
-        cache.set(cache_key, dbids, settings.OBJECT_CACHE_TIMEOUT)
-    return units_queryset.filter(id__in=dbids)
+#: Number of translation projects searched at the same time by the global
+#: search
+SEARCH_THREADS = 4
+#: Maximum number of matches ranked by the global search per index, and
+#: for all the translation projects searched in the database
+SEARCH_CANDIDATES = 1000
 
 
-def get_step_query(request, units_queryset):
-    """Narrows down unit query to units matching conditions in GET and POST."""
+def _search_indexes(jobs):
+    """Runs the queries in ``jobs``, a list of ``(translation_project,
+    indexer, query)`` tuples, in :data:`SEARCH_THREADS` parallel threads.
+
+    :return: A dictionary with lists of at most :data:`SEARCH_CANDIDATES`
+             matching unit ids, keyed by translation project id.
+    """
+    results = {}
+    queue = Queue.Queue()
+    for job in jobs:
+        queue.put(job)
+
+    def worker():
+        while True:
+            try:
+                translation_project, indexer, query = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                if hasattr(indexer, 'iter_values'):
+                    values = indexer.iter_values(query, 'dbid')
+                    try:
+                        dbids = [int(dbid) for dbid, i in
+                                 zip(values, xrange(SEARCH_CANDIDATES))]
+                    finally:
+                        # Releases the indexer
+                        values.close()
+                else:
+                    result = indexer.search(query, ['dbid'])
+                    dbids = [int(item['dbid'][0]) for item in
+                             result[:SEARCH_CANDIDATES]]
+                results[translation_project.id] = dbids
+            except Exception, e:
+                logging.error(u"Failed to search %s:\n%s",
+                              translation_project, e)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(SEARCH_THREADS, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def _rank_search_result(words, fields, unit_values):
+    """Returns a sort key for the unit with ``unit_values``, a dictionary
+    with its ``source_f`` and ``target_f``, ranking first the units whose
+    text in ``fields`` is exactly the search, then those containing the
+    most ``words`` as whole words, then the shortest ones.
+    """
+    texts = []
+    if 'source' in fields:
+        texts.append(unit_values['source_f'])
+    if 'target' in fields:
+        texts.append(unit_values['target_f'])
+    if not texts:
+        texts.append(unit_values['source_f'])
+
+    phrase = u" ".join(words).lower()
+    text_words = set()
+    for text in texts:
+        text_words.update(tokenize(text))
+    whole_words = len([word for word in words
+                       if word.lower() in text_words])
+
+    return (phrase not in [text.strip().lower() for text in texts],
+            -whole_words, len(texts[0]), unit_values['id'])
+
+
+def search_translation_projects(translation_projects, form):
+    """Searches the units of all of ``translation_projects`` for the search
+    in ``form``.
+
+    The indexes of the translation projects are queried in parallel, the
+    database is searched at once for all those whose index isn't ready. No
+    index is built by the search.
+
+    :return: An ``array.array`` of unit ids, best matches first.
+    """
+    words = form.cleaned_data['search'].split()
+    fields = form.cleaned_data['sfields']
+
+    indexed = []
+    non_indexed = []
+    for translation_project in translation_projects:
+        indexer = translation_project.ready_indexer
+        if indexer is None:
+            non_indexed.append(translation_project)
+        else:
+            indexed.append((translation_project, indexer))
+
+    # Results from the database follow the units themselves rather than
+    # the index generation
+    generations = get_generations([tp._get_index_generation_key()
+                                   for tp, unused in indexed])
+    unit_versions = [(tp.id, get_units_generation(tp.id), tp.get_mtime())
+                     for tp in non_indexed]
+    cache_key = "global_search:%s" % str(hash((
+            repr([tp.id for tp in translation_projects]),
+            repr(sorted(generations.items())), repr(unit_versions),
+            repr(words), repr(fields))))
+    dbids = _get_cached_ids(cache_key)
+    if dbids is not None:
+        return dbids
+
+    candidates = []
+    jobs = []
+    for translation_project, indexer in indexed:
+        query = indexer.make_query(_get_word_queries(indexer, words, fields),
+                                   True)
+        jobs.append((translation_project, indexer, query))
+
+    if non_indexed:
+        # A single scan for all the translation projects without an index
+        units = Unit.objects.filter(store__translation_project__in=non_indexed,
+                                    state__gt=OBSOLETE)
+        units = get_non_indexed_search_step_query(form, units)
+        candidates.extend(units.values_list('id', flat=True) \
+                               [:SEARCH_CANDIDATES])
+
+    for dbids in _search_indexes(jobs).itervalues():
+        candidates.extend(dbids)
+
+    ranked = []
+    for i in xrange(0, len(candidates), SEARCH_BATCH):
+        batch = candidates[i:i+SEARCH_BATCH]
+        for unit_values in Unit.objects.filter(id__in=batch) \
+                                       .values('id', 'source_f', 'target_f'):
+            ranked.append(_rank_search_result(words, fields, unit_values))
+    ranked.sort()
+
+    dbids = array('i', [rank[-1] for rank in ranked])
+    _set_cached_ids(cache_key, dbids)
+    return dbids
+
+
+def get_step_query(request, units_queryset, search=True):
+    """Narrows down unit query to units matching conditions in GET and POST.
+
+    The search string is skipped if ``search`` is ``False``, and otherwise
+    looked up in the database: searches through the indexer are done by
+    :func:`_get_search_ids`, which fetches the matches in batches.
+    """
     if 'unitstates' in request.GET:
         unitstates = request.GET['unitstates'].split(',')
         if unitstates:
@@ -293,10 +625,17 @@ def get_step_query(request, units_queryset):
         checks = request.GET['checks'].split(',')
 
         if checks:
-            checks_queryset = units_queryset.filter(
-                qualitycheck__false_positive=False,
-                qualitycheck__name__in=checks
-            )
+            if all(check in check_bits for check in checks):
+                # Avoid joining the quality checks table
+                checks_queryset = units_queryset.filter(failing_checks__gt=0) \
+                    .extra(where=['(%s.failing_checks & %%s) != 0' %
+                                  connection.ops.quote_name(Unit._meta.db_table)],
+                           params=[get_check_mask(checks)])
+            else:
+                checks_queryset = units_queryset.filter(
+                    qualitycheck__false_positive=False,
+                    qualitycheck__name__in=checks
+                )
 
             units_queryset = checks_queryset
 
@@ -314,11 +653,12 @@ def get_step_query(request, units_queryset):
 
             units_queryset = match_queryset
 
-    if 'search' in request.GET and 'sfields' in request.GET:
+    if search and 'search' in request.GET and 'sfields' in request.GET:
         # use the search form for validation only
         search_form = make_search_form(request.GET)
         if search_form.is_valid():
-            units_queryset = get_search_step_query(request.translation_project, search_form, units_queryset)
+            units_queryset = get_non_indexed_search_step_query(search_form,
+                                                               units_queryset)
     return units_queryset
 
 
@@ -370,20 +710,44 @@ def translate(request, store):
 #
 
 def _filter_ctx_units(units_qs, unit, how_many, gap=0):
-    """Returns ``how_many``*2 units that are before and after ``index``."""
+    """Returns ``how_many``*2 units that are before and after ``index``.
+
+    Both sides are read with a single range query over the indexes of the
+    store. A side is only queried on its own when units missing from
+    ``units_qs`` leave holes in that range.
+    """
     result = {'before': [], 'after': []}
 
-    if how_many and unit.index - gap > 0:
-        before = units_qs.filter(store=unit.store_id, index__lt=unit.index) \
-                         .order_by('-index')[gap:how_many+gap]
-        result['before'] = _build_units_list(before, reverse=True)
+    if not how_many:
+        return result
+
+    distance = how_many + gap
+    window = units_qs.filter(store=unit.store_id,
+                             index__gte=unit.index - distance,
+                             index__lte=unit.index + distance) \
+                     .order_by('index')
+    before = []
+    after = []
+    for ctx_unit in window:
+        if ctx_unit.index < unit.index:
+            before.append(ctx_unit)
+        elif ctx_unit.index > unit.index:
+            after.append(ctx_unit)
+
+    if unit.index - gap > 0:
+        before.reverse()
+        if len(before) < min(distance, unit.index):
+            before = units_qs.filter(store=unit.store_id,
+                                     index__lt=unit.index) \
+                             .order_by('-index')
+        result['before'] = _build_units_list(before[gap:distance],
+                                             reverse=True)
         result['before'].reverse()
 
-    #FIXME: can we avoid this query if length is known?
-    if how_many:
+    if len(after) < distance:
         after = units_qs.filter(store=unit.store_id,
-                                index__gt=unit.index)[gap:how_many+gap]
-        result['after'] = _build_units_list(after)
+                                index__gt=unit.index).order_by('index')
+    result['after'] = _build_units_list(after[gap:distance])
 
     return result
 
@@ -455,7 +819,102 @@ def _get_index_in_qs(qs, unit, store=False):
                 qs.filter(store__pootle_path__lt=store.pootle_path)).count()
 
 
-def get_view_units(request, units_queryset, store, limit=0):
+def _get_filters(request):
+    """Returns the filters of the unit list in ``request``, other than the
+    search, as a list of ``(name, value)`` pairs to use in cache keys."""
+    filters = [(name, request.GET[name])
+               for name in ('unitstates', 'checks', 'matchnames')
+               if name in request.GET]
+    if 'matchnames' in request.GET:
+        # Suggestion filters depend on the user
+        filters.append(('profile', request.profile.id))
+    return filters
+
+
+def _get_unit_ids(request, step_queryset, pootle_path):
+    """Returns the ids of the units in ``step_queryset``, which holds the
+    units under ``pootle_path`` narrowed down by the filters in ``request``,
+    in the order of the editor.
+
+    The ids are read in a single ordered scan and cached as a compact array
+    until units of the translation project change, so that pages, the
+    position of a unit and its neighbours are array lookups.
+
+    :rtype: ``array.array`` of ints
+    """
+    filters = _get_filters(request)
+    translation_project = request.translation_project
+    if 'search' in request.GET and 'sfields' in request.GET:
+        # The database search matches the texts of the units, which don't
+        # change the units generation
+        filters.extend([('search', request.GET['search']),
+                        ('sfields', request.GET['sfields']),
+                        ('mtime', translation_project.get_mtime())])
+    descriptor = (pootle_path, tuple(filters),
+                  get_units_generation(translation_project.id))
+    cache_key = "unit_ids:%s" % str(hash(repr(descriptor)))
+
+    unit_ids = _get_cached_ids(cache_key)
+    if unit_ids is None:
+        unit_ids = array('i', step_queryset.order_by('store__pootle_path',
+                                                     'index') \
+                                           .values_list('id', flat=True) \
+                                           .iterator())
+        _set_cached_ids(cache_key, unit_ids)
+    return unit_ids
+
+
+def _get_search_ids(request, units_queryset, step_queryset, pootle_path):
+    """Returns the ids of the units in ``step_queryset`` matching the search
+    in ``request``, in the order of the editor, or ``None`` if there is no
+    search or it can't use the indexer.
+
+    ``pootle_path`` is the path of the store or directory ``units_queryset``
+    is limited to, or ``None`` if unknown.
+    """
+    if not ('search' in request.GET and 'sfields' in request.GET):
+        return None
+
+    # use the search form for validation only
+    search_form = make_search_form(request.GET)
+    if not search_form.is_valid():
+        return None
+
+    translation_project = request.translation_project
+    search_ids = get_search_results(translation_project, search_form,
+                                    pootle_path)
+    if search_ids is None or (pootle_path is not None and
+                              step_queryset is units_queryset):
+        return search_ids
+
+    if pootle_path is not None:
+        # The filters match other units as soon as they change, while the
+        # index is updated a bit later
+        filters = _get_filters(request)
+        filters.append(('units', get_units_generation(translation_project.id)))
+        cache_key = get_search_cache_key(translation_project, pootle_path,
+                                         search_form.cleaned_data['search'].split(),
+                                         search_form.cleaned_data['sfields'],
+                                         filters)
+        filtered_ids = _get_cached_ids(cache_key)
+        if filtered_ids is not None:
+            return filtered_ids
+
+    # Apply the other filters on the matches, a batch at a time to keep
+    # the queries within the database limits
+    filtered_ids = array('i')
+    for i in xrange(0, len(search_ids), SEARCH_BATCH):
+        batch = search_ids[i:i+SEARCH_BATCH]
+        matching = set(step_queryset.filter(id__in=list(batch)) \
+                                    .values_list('id', flat=True))
+        filtered_ids.extend([id for id in batch if id in matching])
+
+    if pootle_path is not None:
+        _set_cached_ids(cache_key, filtered_ids)
+    return filtered_ids
+
+
+def get_view_units(request, units_queryset, store, limit=0, pootle_path=None):
     """Gets source and target texts excluding the editing unit.
 
     :return: An object in JSON notation that contains the source and target
@@ -477,7 +936,13 @@ def get_view_units(request, units_queryset, store, limit=0):
     if not limit:
         limit = request.profile.get_unit_rows()
 
-    step_queryset = get_step_query(request, units_queryset)
+    step_queryset = get_step_query(request, units_queryset, search=False)
+    unit_ids = _get_search_ids(request, units_queryset, step_queryset,
+                               pootle_path)
+    if unit_ids is None:
+        step_queryset = get_step_query(request, units_queryset)
+        if pootle_path is not None:
+            unit_ids = _get_unit_ids(request, step_queryset, pootle_path)
 
     # Return metadata it has been explicitely requested
     if request.GET.get('meta', False):
@@ -490,17 +955,36 @@ def get_view_units(request, units_queryset, store, limit=0):
 
     # Maybe we are trying to load directly a specific unit, so we have
     # to calculate its page number
+    if unit_ids is not None:
+        units_list = UnitIdList(unit_ids, units_queryset)
+    else:
+        units_list = step_queryset
+
     uid = request.GET.get('uid', None)
     if uid:
         current_unit = units_queryset.get(id=uid)
-        preceding = _get_index_in_qs(step_queryset, current_unit, store)
-        page = preceding / limit + 1
+        if unit_ids is not None:
+            try:
+                page = unit_ids.index(current_unit.id) / limit + 1
+            except ValueError:
+                page = None
+        else:
+            preceding = _get_index_in_qs(step_queryset, current_unit, store)
+            page = preceding / limit + 1
     else:
         page = None
 
-    pager = paginate(request, step_queryset, items=limit, page=page)
+    pager = paginate(request, units_list, items=limit, page=page)
 
     json["units"] = _build_units_list(pager.object_list)
+    if unit_ids is not None and json["units"]:
+        # Link the page to its neighbours, so that moving past its edges
+        # doesn't need to fetch them first
+        first = pager.start_index() - 1
+        if first > 0:
+            json["units"][0]["prev"] = unit_ids[first - 1]
+        if pager.end_index() < len(unit_ids):
+            json["units"][-1]["next"] = unit_ids[pager.end_index()]
 
     # Return paging information if requested to do so
     if request.GET.get('pager', False):
@@ -513,12 +997,12 @@ def get_view_units(request, units_queryset, store, limit=0):
         else:
             json["uid"] = current_unit.id
 
-    response = jsonify(json)
-    return HttpResponse(response, mimetype="application/json")
+    return json_response(json)
 
 
 @ajax_required
 @get_store_context('view')
+@condition(etag_func=_get_view_units_etag)
 def get_view_units_store(request, store, limit=0):
     """Gets source and target texts excluding the editing widget (store-level).
 
@@ -526,7 +1010,8 @@ def get_view_units_store(request, store, limit=0):
              texts for units that will be displayed before and after
              unit ``uid``.
     """
-    return get_view_units(request, store.units, store=True, limit=limit)
+    return get_view_units(request, store.units, store=True, limit=limit,
+                          pootle_path=store.pootle_path)
 
 
 def _is_filtered(request):
@@ -538,6 +1023,7 @@ def _is_filtered(request):
 
 @ajax_required
 @get_unit_context('view')
+@condition(etag_func=_get_unit_store_etag)
 def get_more_context(request, unit):
     """Retrieves more context units.
 
@@ -555,51 +1041,85 @@ def get_more_context(request, unit):
     return HttpResponse(response, status=rcode, mimetype="application/json")
 
 
+def _get_timeline(unit):
+    """Returns the changes to ``unit`` grouped by submission time, in
+    chronological order.
+
+    The groups are cached per unit along with the last submission read, so
+    that only later submissions need to be queried and appended.
+
+    :return: A list of ``(creation_time, submitter_id, entries)`` tuples,
+             where entries are ``(field, old_value, new_value)`` tuples.
+    """
+    from pootle_store.fields import to_python
+
+    cache_key = "timeline:%d" % unit.id
+    last_id, groups = cache.get(cache_key, (0, []))
+
+    submissions = Submission.objects.filter(unit=unit, id__gt=last_id,
+                                            field__in=[
+        SubmissionFields.TARGET, SubmissionFields.STATE,
+        SubmissionFields.COMMENT
+    ]).order_by('id')
+
+    changed = False
+    for item in submissions.iterator():
+        if item.field == SubmissionFields.STATE:
+            entry = (item.field, int(to_python(item.old_value)),
+                     int(to_python(item.new_value)))
+        else:
+            entry = (item.field, None, to_python(item.new_value))
+
+        # Only the first submitter of a group is shown
+        if groups and groups[-1][0] == item.creation_time:
+            groups[-1][2].append(entry)
+        else:
+            groups.append((item.creation_time, item.submitter_id, [entry]))
+        last_id = item.id
+        changed = True
+
+    if changed:
+        cache.set(cache_key, (last_id, groups), settings.OBJECT_CACHE_TIMEOUT)
+    return groups
+
+
 @never_cache
 @get_unit_context('view')
+@condition(etag_func=_get_unit_etag)
 def timeline(request, unit):
     """Returns a JSON-encoded string including the changes to the unit
     rendered in HTML.
     """
-    timeline = Submission.objects.filter(unit=unit, field__in=[
-        SubmissionFields.TARGET, SubmissionFields.STATE,
-        SubmissionFields.COMMENT
-    ])
-    timeline = timeline.select_related("submitter__user",
-                                       "translation_project__language")
+    import locale
 
-    context = {}
-    entries_group = []
+    groups = _get_timeline(unit)
+    submitter_ids = set([submitter_id for creation_time, submitter_id, entries
+                         in groups if submitter_id is not None])
+    submitters = PootleProfile.objects.select_related('user') \
+                                      .in_bulk(submitter_ids)
 
-    import locale
-    from itertools import groupby
-    from pootle_store.fields import to_python
+    context = {'language': unit.store.translation_project.language}
+    entries_group = []
 
-    for key, values in groupby(timeline, key=lambda x: x.creation_time):
+    for creation_time, submitter_id, entries in groups:
         entry_group = {
-            'datetime': key,
-            'datetime_str': key.strftime(locale.nl_langinfo(locale.D_T_FMT)),
+            'datetime': creation_time,
+            'datetime_str': creation_time.strftime(locale.nl_langinfo(locale.D_T_FMT)),
+            'submitter': submitters.get(submitter_id),
             'entries': [],
         }
 
-        for item in values:
-            # Only add submitter information for the whole entry group once
-            if 'submitter' not in entry_group:
-                entry_group['submitter'] = item.submitter
-
-            if 'language' not in context:
-                context['language'] = item.translation_project.language
-
+        for field, old_value, new_value in entries:
             entry = {
-                'field': item.field,
-                'field_name': SubmissionFields.NAMES_MAP[item.field],
+                'field': field,
+                'field_name': SubmissionFields.NAMES_MAP[field],
             }
 
-            if item.field == SubmissionFields.STATE:
-                entry['old_value'] = STATES_MAP[int(to_python(item.old_value))]
-                entry['new_value'] = STATES_MAP[int(to_python(item.new_value))]
+            if field == SubmissionFields.STATE:
+                entry['old_value'] = STATES_MAP[old_value]
+                entry['new_value'] = STATES_MAP[new_value]
             else:
-                entry['new_value'] = to_python(item.new_value)
+                entry['new_value'] = new_value
 
             entry_group['entries'].append(entry)
 
@@ -663,21 +1183,82 @@ def comment(request, unit):
     return HttpResponse(response, status=rcode, mimetype="application/json")
 
 
-@never_cache
-@ajax_required
-@get_unit_context('view')
-def get_edit_unit(request, unit):
-    """Given a store path ``pootle_path`` and unit id ``uid``, gathers all the
-    necessary information to build the editing widget.
+#: Maximum number of units whose editing widgets are sent ahead
+EDITOR_PREFETCH = 5
 
-    :return: A templatised editing widget is returned within the ``editor``
-             variable and paging information is also returned if the page
-             number has changed.
+
+def _get_editors(request, units, alt_src_langs, alt_mtimes):
+    """Renders the editing widgets of ``units``, all of the same
+    translation project.
+
+    Widgets are cached for as long as the unit, the permissions of the user
+    and the translation projects of the alternative source languages stay
+    the same. The alternative sources and suggestions of the widgets missing
+    from the cache are looked up together.
+
+    :return: A dictionary of widgets keyed by unit id.
     """
-    json = {}
+    profile = request.profile
+    language_code = get_language()
+    permissions = {}
+    cache_keys = {}
+    for unit in units:
+        directory = unit.store.parent
+        if directory.id not in permissions:
+            permissions[directory.id] = _get_editor_permissions(profile,
+                                                                directory)
+        descriptor = (unit.id, unit.mtime, permissions[directory.id],
+                      profile.id, alt_mtimes, language_code,
+                      _get_editor_template_name(unit))
+        cache_keys[unit.id] = "unit_editor:%s" % str(hash(repr(descriptor)))
+
+    cached = cache.get_many(cache_keys.values())
+    editors = {}
+    missing = []
+    for unit in units:
+        if cache_keys[unit.id] in cached:
+            editors[unit.id] = cached[cache_keys[unit.id]]
+        else:
+            missing.append(unit)
 
-    translation_project = request.translation_project
+    if missing:
+        project = missing[0].store.translation_project.project
+        altsrcs = find_altsrcs_in_bulk(missing, alt_src_langs, project)
+        suggestions = get_sugg_lists_in_bulk(missing)
+        for unit in missing:
+            editor = _render_editor(request, unit,
+                                    permissions[unit.store.parent_id],
+                                    altsrcs[unit.id], suggestions[unit.id])
+            cache.set(cache_keys[unit.id], editor,
+                      settings.OBJECT_CACHE_TIMEOUT)
+            editors[unit.id] = editor
+    return editors
+
+
+def _get_editor_permissions(profile, directory):
+    """Returns whether ``profile`` can translate, suggest and review in
+    ``directory``, matching its permissions only once."""
+    if profile.user.is_superuser:
+        return (True, True, True)
+
+    permissions = get_matching_permissions(profile, directory)
+    return tuple(["administrate" in permissions or codename in permissions
+                  for codename in ("translate", "suggest", "review")])
+
+
+def _get_editor_template_name(unit):
+    if (unit.store.translation_project.project.is_terminology or
+        unit.store.is_terminology):
+        return 'unit/term_edit.html'
+    return 'unit/edit.html'
+
+
+def _render_editor(request, unit, permissions, altsrcs, suggestions):
+    store = unit.store
+    translation_project = store.translation_project
     language = translation_project.language
+    project = translation_project.project
+    cantranslate, cansuggest, canreview = permissions
 
     if unit.hasplural():
         snplurals = len(unit.source.strings)
@@ -689,42 +1270,34 @@ def get_edit_unit(request, unit):
     comment_form_class = unit_comment_form_factory(language)
     comment_form = comment_form_class({}, instance=unit)
 
-    store = unit.store
-    directory = store.parent
-    profile = request.profile
-    alt_src_langs = get_alt_src_langs(request, profile, translation_project)
-    project = translation_project.project
     report_target = ensure_uri(project.report_target)
 
-    suggestions = get_sugg_list(unit)
     template_vars = {
         'unit': unit,
         'form': form,
         'comment_form': comment_form,
         'store': store,
-        'directory': directory,
-        'profile': profile,
+        'directory': store.parent,
+        'profile': request.profile,
         'user': request.user,
         'language': language,
-        'source_language': translation_project.project.source_language,
-        'cantranslate': check_profile_permission(profile, "translate",
-                                                 directory),
-        'cansuggest': check_profile_permission(profile, "suggest", directory),
-        'canreview': check_profile_permission(profile, "review", directory),
-        'altsrcs': find_altsrcs(unit, alt_src_langs, store=store,
-                                project=project),
+        'source_language': project.source_language,
+        'cantranslate': cantranslate,
+        'cansuggest': cansuggest,
+        'canreview': canreview,
+        'altsrcs': altsrcs,
         'report_target': report_target,
         'suggestions': suggestions,
     }
 
-    if translation_project.project.is_terminology or store.is_terminology:
-        t = loader.get_template('unit/term_edit.html')
-    else:
-        t = loader.get_template('unit/edit.html')
+    t = loader.get_template(_get_editor_template_name(unit))
     c = RequestContext(request, template_vars)
-    json['editor'] = t.render(c)
+    return t.render(c)
 
-    rcode = 200
+
+def _get_edit_unit_json(request, unit, editor):
+    json = {}
+    json['editor'] = editor
 
     # Return context rows if filtering is applied but
     # don't return any if the user has asked not to have it
@@ -733,12 +1306,69 @@ def get_edit_unit(request, unit):
 
     if ((_is_filtered(request) or current_filter not in ('all',)) and
         show_ctx == 'true'):
+        store = unit.store
+        project = store.translation_project.project
         # TODO: review if this first 'if' branch makes sense
-        if translation_project.project.is_terminology or store.is_terminology:
+        if project.is_terminology or store.is_terminology:
             json['ctx'] = _filter_ctx_units(store.units, unit, 0)
         else:
             ctx_qty = int(request.COOKIES.get('ctxQty', 1))
             json['ctx'] = _filter_ctx_units(store.units, unit, ctx_qty)
+    return json
+
+
+@never_cache
+@ajax_required
+@get_unit_context('view')
+def get_edit_unit(request, unit):
+    """Given a store path ``pootle_path`` and unit id ``uid``, gathers all the
+    necessary information to build the editing widget.
+
+    Up to ``EDITOR_PREFETCH`` units of the same translation project can be
+    listed as comma-separated ids in the ``next`` parameter, so that the
+    editor can move on to them without waiting for another request. Units
+    in directories the user can't view are left out.
+
+    :return: A templatised editing widget is returned within the ``editor``
+             variable and paging information is also returned if the page
+             number has changed. The widgets of the ``next`` units are
+             returned within the ``next`` object, keyed by unit id.
+    """
+    translation_project = request.translation_project
+    alt_src_langs = get_alt_src_langs(request, request.profile,
+                                      translation_project)
+    alt_mtimes = tuple([(alt_tp.id, alt_tp.get_mtime()) for alt_tp in
+                        TranslationProject.objects.filter(
+                            project=translation_project.project_id,
+                            language__in=alt_src_langs,
+                        ).order_by('id')])
+
+    next_ids = [int(uid) for uid in request.GET.get('next', '').split(',')
+                if uid.isdigit()][:EDITOR_PREFETCH]
+    next_units = []
+    if next_ids:
+        can_view = {}
+        for next_unit in Unit.objects.filter(id__in=next_ids,
+                                             store__translation_project=translation_project) \
+                                     .select_related("store__translation_project",
+                                                     "store__parent"):
+            directory = next_unit.store.parent
+            if directory.id not in can_view:
+                can_view[directory.id] = check_profile_permission(
+                        request.profile, 'view', directory)
+            if can_view[directory.id]:
+                next_units.append(next_unit)
+
+    editors = _get_editors(request, [unit] + next_units, alt_src_langs,
+                           alt_mtimes)
+    json = _get_edit_unit_json(request, unit, editors[unit.id])
+    if next_ids:
+        json['next'] = dict([(next_unit.id,
+                              _get_edit_unit_json(request, next_unit,
+                                                  editors[next_unit.id]))
+                             for next_unit in next_units])
+
+    rcode = 200
     response = jsonify(json)
     return HttpResponse(response, status=rcode, mimetype="application/json")
 
@@ -749,16 +1379,14 @@ def get_failing_checks(request, pathobj):
     :return: JSON string with a list of failing check categories which
              include the actual checks that are failing.
     """
-    stats = get_raw_stats(pathobj)
-    failures = get_quality_check_failures(pathobj, stats, include_url=False)
-
-    response = jsonify(failures)
+    response = get_quality_check_failures_json(pathobj)
 
     return HttpResponse(response, mimetype="application/json")
 
 
 @ajax_required
 @get_store_context('view')
+@condition(etag_func=_get_store_etag)
 def get_failing_checks_store(request, store):
     return get_failing_checks(request, store)
 
@@ -1006,6 +1634,7 @@ def reject_qualitycheck(request, unit, checkid):
             check = unit.qualitycheck_set.get(id=checkid)
             check.false_positive = True
             check.save()
+            unit.refresh_failing_checks()
             # update timestamp
             unit.save()
         except ObjectDoesNotExist:
@@ -1013,3 +1642,53 @@ def reject_qualitycheck(request, unit, checkid):
 
     response = jsonify(json)
     return HttpResponse(response, mimetype="application/json")
+
+
+@ajax_required
+def search(request):
+    """Searches the units of all the translation projects the user can view.
+
+    The search can be limited to a language or a project with the
+    ``language`` and ``project`` codes in GET.
+
+    :return: An object in JSON notation with a page of matching units, best
+             matches first, and pager information.
+    """
+    json = {}
+    search_form = make_search_form(request.GET)
+    if not search_form.is_valid():
+        json["msg"] = _("Invalid search.")
+        response = jsonify(json)
+        return HttpResponse(response, status=400, mimetype="application/json")
+
+    profile = get_profile(request.user)
+    translation_projects = TranslationProject.objects \
+                                             .select_related('directory')
+    if request.GET.get('language', None):
+        translation_projects = translation_projects.filter(
+                language__code=request.GET['language'])
+    if request.GET.get('project', None):
+        translation_projects = translation_projects.filter(
+                project__code=request.GET['project'])
+    translation_projects = [tp for tp in translation_projects.iterator()
+                            if check_profile_permission(profile, 'view',
+                                                        tp.directory)]
+
+    dbids = search_translation_projects(translation_projects, search_form)
+    units = Unit.objects.select_related('store__translation_project__language',
+                                        'store__translation_project__project')
+    pager = paginate(request, UnitIdList(dbids, units),
+                     items=profile.get_unit_rows())
+
+    json["units"] = _build_units_list(pager.object_list)
+    for unit, unit_dict in zip(pager.object_list, json["units"]):
+        translation_project = unit.store.translation_project
+        unit_dict.update({
+            'pootle_path': unit.store.pootle_path,
+            'language': translation_project.language.code,
+            'project': translation_project.project.code,
+            'url': l(unit.store.pootle_path + '/translate/#unit=%d' % unit.id),
+        })
+    json["pager"] = _build_pager_dict(pager)
+
+    return json_response(json)
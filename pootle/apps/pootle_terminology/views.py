@@ -95,13 +95,16 @@ def extract(request, translation_project):
         # calculate maximum terms
         maxunits = int(translation_project.getquickstats()['totalsourcewords'] * 0.02)
         maxunits = min(max(settings.MIN_AUTOTERMS, maxunits), settings.MAX_AUTOTERMS)
+        new_suggestions = []
         for index, (score, unit) in enumerate(termunits[:maxunits]):
             unit.store = store
             unit.index = index
             #FIXME: what to do with score?
             unit.save()
             for suggestion in unit.pending_suggestions:
-                unit.add_suggestion(suggestion) # Touch=True which saves unit on every call
+                new_suggestions.append((unit, suggestion, None))
+        # Units were just saved, no need to touch them again
+        store.add_suggestions(new_suggestions, touch=False)
 
         # unlock file
         store.state = oldstate
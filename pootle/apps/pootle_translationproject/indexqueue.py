@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 Zuza Software Foundation
+#
+# This file is part of Pootle.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Queue of units waiting to be updated in the search index.
+
+Changed units are collected per translation project and indexed in a
+background thread after :setting:`INDEX_UPDATE_DELAY` seconds, so that
+saving a unit does not wait for the indexer and that bursts of changes are
+written in a single indexer transaction.
+
+Units changed inside a managed transaction are only scheduled once it is
+committed, so that the background thread never reads them before.
+"""
+
+import logging
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import transaction
+
+
+_lock = threading.Lock()
+_pending = {}
+_timer = None
+
+# Units queued by each thread in the transaction it has open
+_local = threading.local()
+
+
+def queue_units(translation_project_id, unit_ids):
+    """Schedules the units with ids ``unit_ids`` of the translation project
+    with id ``translation_project_id`` to be re-indexed.
+
+    Inside a managed transaction, the units are only scheduled by
+    :func:`transaction_committed`.
+
+    Units that do not exist anymore when the queue is flushed are removed
+    from the index.
+    """
+    if not unit_ids:
+        return
+
+    if transaction.is_managed():
+        uncommitted = getattr(_local, 'uncommitted', None)
+        if uncommitted is None:
+            uncommitted = _local.uncommitted = {}
+        uncommitted.setdefault(translation_project_id, set()).update(unit_ids)
+    else:
+        _schedule({translation_project_id: unit_ids})
+
+
+def _schedule(units):
+    delay = getattr(settings, 'INDEX_UPDATE_DELAY', 2)
+    for translation_project_id, unit_ids in units.iteritems():
+        _add_pending(translation_project_id, unit_ids, delay)
+    if not delay:
+        flush()
+
+
+def transaction_committed(**kwargs):
+    """Schedules the units queued by this thread in the transaction that
+    was just committed or rolled back.
+
+    It is connected to ``request_finished``, which is sent once
+    ``TransactionMiddleware`` is done with the transaction of the request.
+    """
+    uncommitted = getattr(_local, 'uncommitted', None)
+    if uncommitted:
+        _local.uncommitted = {}
+        _schedule(uncommitted)
+
+request_finished.connect(transaction_committed)
+
+
+def commit_on_success(func):
+    """Same as Django's ``commit_on_success`` decorator, which also
+    schedules the queued units once the outermost managed transaction is
+    over."""
+    func = transaction.commit_on_success(func)
+
+    def _commit_on_success(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if not transaction.is_managed():
+                transaction_committed()
+
+    return wraps(func)(_commit_on_success)
+
+
+def _add_pending(translation_project_id, unit_ids, delay):
+    global _timer
+
+    _lock.acquire()
+    try:
+        _pending.setdefault(translation_project_id, set()).update(unit_ids)
+        if delay and _timer is None:
+            _timer = threading.Timer(delay, _flush_worker)
+            _timer.setDaemon(True)
+            _timer.start()
+    finally:
+        _lock.release()
+
+
+def flush():
+    """Indexes all the queued units, one transaction per translation
+    project."""
+    global _timer
+    from pootle_translationproject.models import TranslationProject
+
+    _lock.acquire()
+    try:
+        pending = _pending.copy()
+        _pending.clear()
+        _timer = None
+    finally:
+        _lock.release()
+
+    for translation_project in TranslationProject.objects \
+                                                 .filter(id__in=pending.keys()) \
+                                                 .iterator():
+        unit_ids = pending[translation_project.id]
+        # Indexes that aren't ready are brought up to date with the stores
+        # when they are built, don't start a build here
+        indexer = translation_project.ready_indexer
+        if indexer is None:
+            if translation_project.is_index_building:
+                # The build may already have passed these units' stores,
+                # try again later
+                _add_pending(translation_project.id, unit_ids,
+                             getattr(settings, 'INDEX_UPDATE_DELAY', 2) or 1)
+            continue
+
+        try:
+            translation_project.update_index_units(indexer, unit_ids)
+        except Exception, e:
+            logging.error(u"Failed to update the search index of %s:\n%s",
+                          translation_project, e)
+
+
+def _flush_worker():
+    from django.db import connection
+
+    try:
+        flush()
+    except Exception, e:
+        logging.error(u"Failed to update the search index:\n%s", e)
+    finally:
+        connection.close()
@@ -21,13 +21,17 @@
 import gettext
 import logging
 import os
+import Queue
+import threading
+from itertools import groupby
 
 from django.conf import settings
 from django.contrib import messages
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.db import models, IntegrityError
 from django.db.models.signals import post_save
-from django.utils.encoding import force_unicode
+from django.utils.encoding import force_unicode, iri_to_uri
 from django.utils.translation import ugettext_lazy as _
 
 from translate.misc.lru import LRUCachingDict
@@ -41,14 +45,50 @@ from pootle_misc.aggregate import group_by_count_extra, max_column
 from pootle_misc.baseurl import l
 from pootle_misc.stats import stats_message, stats_message_raw
 from pootle_misc.util import (getfromcache, dictsum, deletefromcache,
-                              get_markup_filter_name, apply_markup_filter)
+                              get_generation,
+                              update_generation, get_markup_filter_name,
+                              apply_markup_filter)
 from pootle_project.models import Project
 from pootle_store.models import Store, Unit, QualityCheck, PARSED, CHECKED
+from pootle_store.qualitychecks import (QualityCheckRunner, get_checker,
+                                        get_stale_stores, start_upgrade_worker)
 from pootle_store.util import (absolute_real_path, calculate_stats,
                                empty_quickstats, empty_completestats,
                                relative_real_path, OBSOLETE, UNTRANSLATED)
 
 
+# Number of units re-indexed per query by update_index_units
+INDEX_BATCH = 100
+
+# Maximum number of seconds a server process keeps other processes from
+# building the same index
+INDEX_BUILD_LOCK_TIMEOUT = 3600
+
+# Maximum number of translation projects waiting for their index to be built
+INDEX_BUILD_QUEUE_SIZE = 32
+
+_index_build_lock = threading.Lock()
+_index_build_queue = Queue.Queue(INDEX_BUILD_QUEUE_SIZE)
+_index_build_thread = None
+
+
+def _index_build_worker():
+    """Builds the indexes of the queued translation projects, one at a
+    time."""
+    from django.db import connection
+
+    while True:
+        translation_project = _index_build_queue.get()
+        logging.info(u"Building the search index of %s",
+                     translation_project.pootle_path)
+        try:
+            translation_project.build_index()
+        finally:
+            translation_project.non_db_state._index_building = False
+            cache.delete(translation_project._get_index_build_key())
+            connection.close()
+
+
 class TranslationProjectNonDBState(object):
 
     def __init__(self, parent):
@@ -60,6 +100,7 @@ class TranslationProjectNonDBState(object):
 
         self._indexing_enabled = True
         self._index_initialized = False
+        self._index_building = False
         self.indexer = None
 
 
@@ -82,6 +123,21 @@ def scan_translation_projects():
             create_translation_project(language, project)
 
 
+def _get_translation_projects_generation_key(project_id):
+    return "translation_projects_generation:%d" % project_id
+
+
+def get_translation_projects_generation(project_id):
+    """Returns a counter that changes whenever translation projects of the
+    project with id ``project_id`` are saved or deleted, to be used in the
+    cache keys of what depends on the languages of the project."""
+    return get_generation(_get_translation_projects_generation_key(project_id))
+
+
+def update_translation_projects_generation(project_id):
+    update_generation(_get_translation_projects_generation_key(project_id))
+
+
 class VersionControlError(Exception):
     pass
 
@@ -139,6 +195,7 @@ class TranslationProject(models.Model):
         self.description_html = apply_markup_filter(self.description)
 
         super(TranslationProject, self).save(*args, **kwargs)
+        update_translation_projects_generation(self.project_id)
 
         if created:
             self.scan_files()
@@ -147,9 +204,11 @@ class TranslationProject(models.Model):
         directory = self.directory
 
         super(TranslationProject, self).delete(*args, **kwargs)
+        update_translation_projects_generation(self.project_id)
 
         directory.delete()
         deletefromcache(self, ["getquickstats", "getcompletestats",
+                               "get_quality_check_failures",
                                "get_mtime", "get_suggestion_count"])
 
     def get_absolute_url(self):
@@ -172,17 +231,17 @@ class TranslationProject(models.Model):
     file_style = property(_get_treestyle)
 
     def _get_checker(self):
-        from translate.filters import checks
-        checkerclasses = [checks.projectcheckers.get(self.project.checkstyle,
-                                                     checks.StandardChecker),
-                          checks.StandardUnitChecker]
-        return checks.TeeChecker(checkerclasses=checkerclasses,
-                                 excludefilters=['hassuggestion'],
-                                 errorhandler=self.filtererrorhandler,
-                                 languagecode=self.language.code)
+        return get_checker(self.project.checkstyle, self.language.code,
+                           errorhandler=self.filtererrorhandler)
 
     checker = property(_get_checker)
 
+    def get_qualitycheck_runner(self, processes=None):
+        """Returns a runner for this project's quality checks. Callers must
+        :meth:`~pootle_store.qualitychecks.QualityCheckRunner.close` it."""
+        return QualityCheckRunner(self.project.checkstyle, self.language.code,
+                                  processes=processes)
+
     def filtererrorhandler(self, functionname, str1, str2, e):
         logging.error(u"error in filter %s: %r, %r, %s", functionname, str1,
                 str2, e)
@@ -194,8 +253,7 @@ class TranslationProject(models.Model):
                 self._non_db_state = self._non_db_state_cache[self.id]
             except KeyError:
                 self._non_db_state = TranslationProjectNonDBState(self)
-                self._non_db_state_cache[self.id] = \
-                        TranslationProjectNonDBState(self)
+                self._non_db_state_cache[self.id] = self._non_db_state
 
         return self._non_db_state
 
@@ -268,8 +326,17 @@ class TranslationProject(models.Model):
         if self.is_template_project:
             return empty_completestats
 
-        for store in self.stores.filter(state__lt=CHECKED).iterator():
-            store.require_qualitychecks()
+        # Share a single runner (and its worker processes) among stores
+        runner = self.get_qualitycheck_runner()
+        try:
+            for store in self.stores.filter(state__lt=CHECKED).iterator():
+                store.require_qualitychecks(runner=runner)
+        finally:
+            runner.close()
+
+        if get_stale_stores(self.stores.all()).exists():
+            # Keep serving the current results while they are upgraded
+            start_upgrade_worker()
 
         query = QualityCheck.objects.filter(
             unit__store__translation_project=self,
@@ -278,6 +345,19 @@ class TranslationProject(models.Model):
         )
         return group_by_count_extra(query, 'name', 'category')
 
+    def upgrade_qualitychecks(self):
+        """Re-runs the quality checks of the stores checked with an older
+        checker version, keeping false positives."""
+        runner = self.get_qualitycheck_runner()
+        try:
+            for store in get_stale_stores(self.stores.all()).iterator():
+                logging.debug(u"Upgrading quality checks for %s",
+                              store.pootle_path)
+                store.update_qualitychecks(runner=runner,
+                                           keep_false_positives=True)
+        finally:
+            runner.close()
+
     def update_from_templates(self, pootle_path=None):
         """Update translation project from templates."""
 
@@ -369,29 +449,107 @@ class TranslationProject(models.Model):
         return all_files, new_files
 
     def _get_indexer(self):
+        """Returns the indexer of this translation project, or ``None`` if
+        indexing is disabled or the index is still being built.
+
+        Unless :setting:`INDEX_BACKGROUND_BUILD` is disabled, the index is
+        queued for a background build the first time it is requested, and
+        searches use the database in the meantime. Use :attr:`ready_indexer`
+        to get the indexer without building the index.
+        """
         if self.non_db_state.indexer is None and \
                 self.non_db_state._indexing_enabled:
-            try:
-                indexer = self.make_indexer()
-                if not self.non_db_state._index_initialized:
-                    self.init_index(indexer)
-                    self.non_db_state._index_initialized = True
-                self.non_db_state.indexer =  indexer
-            except Exception, e:
-                logging.warning(u"Could not initialize indexer for %s in %s: "
-                        "%s", self.project.code, self.language.code, str(e))
-                self.non_db_state._indexing_enabled = False
+            if getattr(settings, 'INDEX_BACKGROUND_BUILD', True):
+                self.start_index_build()
+            else:
+                self.build_index()
 
         return self.non_db_state.indexer
 
     indexer = property(_get_indexer)
 
+    def _get_ready_indexer(self):
+        """Returns the indexer of this translation project if the index has
+        already been built, ``None`` otherwise."""
+        return self.non_db_state.indexer
+
+    ready_indexer = property(_get_ready_indexer)
+
     def _has_index(self):
         return (self.non_db_state._indexing_enabled and
                 (self.non_db_state._index_initialized or self.indexer != None))
 
     has_index = property(_has_index)
 
+    def _get_index_build_key(self):
+        return iri_to_uri(self.pootle_path + ":index_build")
+
+    def _is_index_building(self):
+        """Whether the index is being built by this or another server
+        process."""
+        return (self.non_db_state._index_building or
+                cache.get(self._get_index_build_key()) is not None)
+
+    is_index_building = property(_is_index_building)
+
+    def build_index(self):
+        """Opens the indexer and brings the index up to date with the
+        stores. The indexer is only made available once this is done.
+
+        :return: The indexer, or ``None`` if it could not be initialized.
+        """
+        try:
+            indexer = self.make_indexer()
+            if not self.non_db_state._index_initialized:
+                self.init_index(indexer)
+                self.non_db_state._index_initialized = True
+            self.non_db_state.indexer = indexer
+        except Exception, e:
+            logging.warning(u"Could not initialize indexer for %s in %s: "
+                    "%s", self.project.code, self.language.code, str(e))
+            self.non_db_state._indexing_enabled = False
+
+        return self.non_db_state.indexer
+
+    def start_index_build(self):
+        """Queues the index to be built by the background build thread,
+        unless a build is already running or queued for this translation
+        project in any server process.
+
+        Indexes are built one at a time. If ``INDEX_BUILD_QUEUE_SIZE``
+        translation projects are already waiting, nothing is queued and the
+        build is tried again the next time the indexer is requested.
+
+        :return: ``True`` if the build was queued.
+        """
+        global _index_build_thread
+
+        _index_build_lock.acquire()
+        try:
+            if self.non_db_state._index_building:
+                return False
+            lock_key = self._get_index_build_key()
+            if not cache.add(lock_key, True, INDEX_BUILD_LOCK_TIMEOUT):
+                return False
+            self.non_db_state._index_building = True
+            try:
+                _index_build_queue.put_nowait(self)
+            except Queue.Full:
+                self.non_db_state._index_building = False
+                cache.delete(lock_key)
+                return False
+
+            if _index_build_thread is None or \
+                    not _index_build_thread.isAlive():
+                _index_build_thread = threading.Thread(
+                        target=_index_build_worker, name="index-build")
+                _index_build_thread.setDaemon(True)
+                _index_build_thread.start()
+        finally:
+            _index_build_lock.release()
+
+        return True
+
     def update_file_from_version_control(self, store):
         from pootle.scripts import hooks
         store.sync(update_translation=True)
@@ -718,7 +876,12 @@ class TranslationProject(models.Model):
         logging.debug(u"Loading indexer for %s", self.pootle_path)
         indexdir = os.path.join(self.abs_real_path, self.index_directory)
         from translate.search import indexing
-        index = indexing.get_indexer(indexdir)
+        try:
+            index = indexing.get_indexer(indexdir)
+        except IndexError:
+            # No Xapian or Lucene, fall back to the embedded engine
+            from pootle_misc.indexer import SQLiteDatabase
+            index = SQLiteDatabase(indexdir)
         index.set_field_analyzers({
                         "pofilename": index.ANALYZER_EXACT,
                         "itemno": index.ANALYZER_EXACT,
@@ -807,8 +970,57 @@ class TranslationProject(models.Model):
             indexer.delete_doc({"pofilename": store.pootle_path})
             units = store.units
 
-        addlist = []
-        for unit in units.iterator():
+        self._index_units(indexer, store, units.iterator(), pomtime)
+        self._update_index_generation()
+
+    def update_index_units(self, indexer, unit_ids):
+        """Updates the index entries of the units with ids in ``unit_ids``
+        in a single indexer transaction.
+
+        Units that were deleted or made obsolete are removed from the index.
+        This is used by :mod:`pootle_translationproject.indexqueue` to apply
+        the edits queued by :meth:`Unit.save`.
+        """
+        if indexer is None:
+            return False
+
+        unit_ids = sorted(unit_ids)
+        indexer.begin_transaction()
+        try:
+            for start in range(0, len(unit_ids), INDEX_BATCH):
+                chunk = unit_ids[start:start+INDEX_BATCH]
+                itemsquery = indexer.make_query([("dbid", str(unitid))
+                                                 for unitid in chunk], False)
+                indexer.delete_doc([itemsquery])
+
+                units = Unit.objects.filter(id__in=chunk,
+                                            store__translation_project=self,
+                                            state__gt=OBSOLETE) \
+                                    .select_related('store') \
+                                    .order_by('store')
+                for store, store_units in groupby(units.iterator(),
+                                                  lambda unit: unit.store):
+                    pomtime = str(hash(store.get_mtime()) ** 2)
+                    self._index_units(indexer, store, store_units, pomtime)
+            indexer.commit_transaction()
+        except:
+            indexer.cancel_transaction()
+            raise
+        self._update_index_generation()
+
+    def _get_index_generation_key(self):
+        return iri_to_uri(self.pootle_path + ":index_generation")
+
+    def get_index_generation(self):
+        """Returns a counter that changes whenever the search index of this
+        translation project is updated, to be used in search cache keys."""
+        return get_generation(self._get_index_generation_key())
+
+    def _update_index_generation(self):
+        update_generation(self._get_index_generation_key())
+
+    def _index_units(self, indexer, store, units, pomtime):
+        for unit in units:
             doc = {"pofilename": store.pootle_path,
                    "pomtime": pomtime,
                    "itemno": str(unit.index),
@@ -826,11 +1038,7 @@ class TranslationProject(models.Model):
             doc["target"] = trans
             doc["notes"] = unit.getnotes()
             doc["locations"] = unit.getlocations()
-            addlist.append(doc)
-
-        if addlist:
-            for add_item in addlist:
-                indexer.index_document(add_item)
+            indexer.index_document(doc)
 
     ###########################################################################
 
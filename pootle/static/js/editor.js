@@ -19,6 +19,8 @@
 
     /* Initialize variables */
     this.units = {};
+    this.editUnits = {};
+    this.prefetchQty = 3;
     this.store = $("#editor").data("pootle-path");
     this.directory = $("#editor").data("directory");
     this.currentPage = 1;
@@ -873,6 +875,7 @@
             // Clear old data and add new results
             PTL.editor.pagesGot = {};
             PTL.editor.units = {};
+            PTL.editor.editUnits = {};
             PTL.editor.updatePager(data.pager);
             // PTL.editor.fetchPages(false);
             if (data.uid) {
@@ -1161,6 +1164,53 @@
     return newPager;
   },
 
+  /* Returns the uids of the units following 'uid' which editing
+   * widgets haven't been fetched yet */
+  getPrefetchUids: function (uid) {
+    var i,
+        uids = [],
+        nextUid = uid;
+
+    for (i=0; i<this.prefetchQty; i++) {
+      nextUid = this.units[nextUid] && this.units[nextUid].next;
+      if (!nextUid) {
+        break;
+      }
+      if (!(nextUid in this.editUnits)) {
+        uids.push(nextUid);
+      }
+    }
+
+    return uids;
+  },
+
+  /* Stores the editing widgets sent ahead by the server */
+  storeEditUnits: function (editUnits) {
+    if (editUnits) {
+      $.extend(this.editUnits, editUnits);
+    }
+  },
+
+  /* Fetches in the background the editing widgets following 'uid' */
+  prefetchEditUnits: function (uid) {
+    var uids = this.getPrefetchUids(uid),
+        reqData = this.getReqData();
+
+    if (uids.length) {
+      reqData.next = uids.slice(1).join(',');
+      $.ajax({
+        url: l('/unit/edit/' + uids[0]),
+        async: true,
+        data: reqData,
+        dataType: 'json',
+        success: function (data) {
+          PTL.editor.editUnits[uids[0]] = data;
+          PTL.editor.storeEditUnits(data.next);
+        }
+      });
+    }
+  },
+
   /* Loads the edit unit 'uid' */
   getEditUnit: function (uid) {
     var editor, editCtxRowBefore, editCtxRowAfter, editCtxWidgets, hasData,
@@ -1168,28 +1218,41 @@
         editUrl = l('/unit/edit/' + uid),
         reqData = this.getReqData(),
         widget = '',
-        ctx = {before: [], after: []};
+        ctx = {before: [], after: []},
+        editUnit = this.editUnits[uid];
 
-    $.ajax({
-      url: editUrl,
-      async: false,
-      data: reqData,
-      dataType: 'json',
-      success: function (data) {
-        widget = data['editor'];
-        // Update pager in case it's needed
-        PTL.editor.updatePager(PTL.editor.createPager(uid));
-
-        if (data.ctx) {
-          // Initialize context gap to the maximum context rows available
-          PTL.editor.ctxGap = Math.max(data.ctx.before.length,
-                                       data.ctx.after.length);
-          ctx.before = data.ctx.before;
-          ctx.after = data.ctx.after;
-        }
-      },
-      error: PTL.editor.error
-    });
+    if (editUnit) {
+      // Sent ahead, keep fetching the following ones
+      delete this.editUnits[uid];
+      this.prefetchEditUnits(uid);
+    } else {
+      reqData.next = this.getPrefetchUids(uid).join(',');
+      $.ajax({
+        url: editUrl,
+        async: false,
+        data: reqData,
+        dataType: 'json',
+        success: function (data) {
+          editUnit = data;
+          PTL.editor.storeEditUnits(data.next);
+        },
+        error: PTL.editor.error
+      });
+    }
+
+    if (editUnit) {
+      widget = editUnit['editor'];
+      // Update pager in case it's needed
+      PTL.editor.updatePager(PTL.editor.createPager(uid));
+
+      if (editUnit.ctx) {
+        // Initialize context gap to the maximum context rows available
+        PTL.editor.ctxGap = Math.max(editUnit.ctx.before.length,
+                                     editUnit.ctx.after.length);
+        ctx.before = editUnit.ctx.before;
+        ctx.after = editUnit.ctx.after;
+      }
+    }
 
     eClass += this.units[uid].isfuzzy ? " fuzzy-unit" : "";
 
@@ -30,6 +30,9 @@ class PootleTestCase(TestCase):
         settings.PODIRECTORY = self.testpodir
         fs.location = self.testpodir
         TranslationProject._non_db_state_cache.clear()
+        # Background threads can't see the in-memory test database
+        settings.INDEX_UPDATE_DELAY = 0
+        settings.INDEX_BACKGROUND_BUILD = False
 
     def _setup_test_files(self):
         gnu = os.path.join(self.testpodir, "terminology")